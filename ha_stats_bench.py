@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# Synthetic Home Assistant recorder DB generator + benchmark for ha_stats_fixer
+# - generate: home-assistant_v2.db look-alike, new (start_ts epoch) or legacy (start text) schema,
+#   N entities (energy meters with sum/state, sensors with mean/min/max), years of hourly
+#   `statistics`, days of 5-minute `statistics_short_term`, injected sum jumps
+# - run: times preview / diagnose / apply (+ undo) / backup at 10^5 … 10^8 rows, writes JSON
+#
+#   python ha_stats_bench.py generate test.db --schema legacy --entities 20 --years 2 --jumps 5
+#   python ha_stats_bench.py run --rows 1e5,1e6,1e7 --schema both --out bench.json
+# - check-spikes: compares the numpy and the pure Python path of find_spikes on random series
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics as pystats
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import ha_stats_fixer as fixer
+
+SCHEMAS = ("ts", "legacy")
+HOURS_PER_YEAR = 8766
+SHORT_TERM_DAYS = 10  # recorder keeps ~10 days of 5-minute statistics by default
+METER_SHARE = 0.6
+INSERT_BATCH = 100000
+LEGACY_FORMAT = "%Y-%m-%d %H:%M:%S"
+BENCH_END = datetime(2025, 10, 1, tzinfo=timezone.utc)
+BENCH_OPS = ("preview", "diagnose", "apply", "undo", "backup")
+
+def create_schema(conn, schema):
+    # column sets of the recorder tables before/after the start_ts migration (schema 23 vs 43+)
+    conn.execute("""
+        CREATE TABLE statistics_meta (
+            id INTEGER PRIMARY KEY, statistic_id VARCHAR(255), source VARCHAR(32),
+            unit_of_measurement VARCHAR(255), has_mean BOOLEAN, has_sum BOOLEAN, name VARCHAR(255)
+        );
+    """)
+    conn.execute("CREATE UNIQUE INDEX ix_statistics_meta_statistic_id ON statistics_meta (statistic_id);")
+    for table in fixer.STAT_TABLES:
+        if schema == "legacy":
+            conn.execute(f"""
+                CREATE TABLE {table} (
+                    id INTEGER PRIMARY KEY, created DATETIME, metadata_id INTEGER, start DATETIME,
+                    mean FLOAT, min FLOAT, max FLOAT, last_reset DATETIME, state FLOAT, sum FLOAT
+                );
+            """)
+            conn.execute(f"CREATE UNIQUE INDEX ix_{table}_statistic_id_start ON {table} (metadata_id, start);")
+            conn.execute(f"CREATE INDEX ix_{table}_start ON {table} (start);")
+        else:
+            conn.execute(f"""
+                CREATE TABLE {table} (
+                    id INTEGER PRIMARY KEY, created DATETIME, created_ts FLOAT, metadata_id INTEGER,
+                    start DATETIME, start_ts FLOAT, mean FLOAT, min FLOAT, max FLOAT,
+                    last_reset DATETIME, last_reset_ts FLOAT, state FLOAT, sum FLOAT
+                );
+            """)
+            conn.execute(f"CREATE UNIQUE INDEX ix_{table}_statistic_id_start_ts ON {table} (metadata_id, start_ts);")
+            conn.execute(f"CREATE INDEX ix_{table}_start_ts ON {table} (start_ts);")
+
+def meter_sums(rnd, hours, base):
+    # hourly consumption with a day/night profile; returns the hourly deltas
+    return [base * (0.3 + 0.7 * max(0.0, math.sin(math.pi * ((h % 24) - 6) / 14))) * rnd.uniform(0.5, 1.5)
+            for h in range(hours)]
+
+def generate_db(path, schema="ts", entities=10, years=1.0, short_term_days=SHORT_TERM_DAYS, jumps=3, seed=1,
+                end=BENCH_END):
+    # returns a summary dict (row counts, injected jumps) for the written DB
+    if schema not in SCHEMAS:
+        raise ValueError(f"Unknown schema: {schema}")
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+    hours = max(2, int(years * HOURS_PER_YEAR))
+    st_hours = min(hours, int(short_term_days * 24))
+    t_end = int(end.timestamp()) // 3600 * 3600
+    t0 = t_end - hours * 3600
+    n_meters = max(1, round(entities * METER_SHARE))
+    meters = list(range(1, n_meters + 1))
+    planned = {}
+    for _ in range(jumps):
+        planned.setdefault(rnd.choice(meters), []).append((rnd.randrange(1, hours), round(rnd.uniform(500, 5000), 3)))
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    create_schema(conn, schema)
+    fmt = lambda ts: time.strftime(LEGACY_FORMAT, time.gmtime(ts)) + ".000000"
+    if schema == "legacy":
+        cols = "metadata_id, created, start, mean, min, max, state, sum"
+        at = lambda ts: (fmt(ts + 3600), fmt(ts))
+    else:
+        cols = "metadata_id, created_ts, start_ts, mean, min, max, state, sum"
+        at = lambda ts: (ts + 3600.0, float(ts))
+    insert = {t: f"INSERT INTO {t} ({cols}) VALUES (?, ?, ?, ?, ?, ?, ?, ?);" for t in fixer.STAT_TABLES}
+    rows = {t: 0 for t in fixer.STAT_TABLES}
+    injected = []
+
+    def flush(table, batch):
+        conn.executemany(insert[table], batch)
+        rows[table] += len(batch)
+        batch.clear()
+
+    for mid in range(1, entities + 1):
+        is_meter = mid <= n_meters
+        sid = f"sensor.bench_{'energy' if is_meter else 'temperature'}_{mid:05d}"
+        conn.execute("INSERT INTO statistics_meta VALUES (?, ?, ?, ?, ?, ?, ?);",
+                     (mid, sid, "recorder", "kWh" if is_meter else "°C", int(not is_meter), int(is_meter), None))
+        hourly, short = [], []
+        if is_meter:
+            deltas = meter_sums(rnd, hours, rnd.uniform(0.05, 2.0))
+            for h, delta in planned.get(mid, []):
+                deltas[h] += delta
+                injected.append({"statistic_id": sid, "metadata_id": mid, "start_ts": t0 + h * 3600,
+                                 "start": fmt(t0 + h * 3600)[:19], "delta": delta})
+            total, reading = 0.0, rnd.uniform(1000, 50000)
+            for h, d in enumerate(deltas):
+                ts = t0 + h * 3600
+                if h >= hours - st_hours:
+                    for k in range(12):
+                        part = d * (k + 1) / 12
+                        short.append((mid, *at(ts + k * 300), None, None, None,
+                                      round(reading + total + part, 3), round(total + part, 3)))
+                total += d
+                hourly.append((mid, *at(ts), None, None, None, round(reading + total, 3), round(total, 3)))
+                if len(short) >= INSERT_BATCH:
+                    flush("statistics_short_term", short)
+                if len(hourly) >= INSERT_BATCH:
+                    flush("statistics", hourly)
+        else:
+            base = rnd.uniform(-5, 25)
+            for h in range(hours):
+                ts = t0 + h * 3600
+                mean = base + 6 * math.sin(2 * math.pi * (h % 24) / 24) + 8 * math.sin(2 * math.pi * h / HOURS_PER_YEAR)
+                if h >= hours - st_hours:
+                    for k in range(12):
+                        v = mean + rnd.gauss(0, 0.3)
+                        short.append((mid, *at(ts + k * 300), round(v, 2), round(v - 0.1, 2), round(v + 0.1, 2), None, None))
+                hourly.append((mid, *at(ts), round(mean, 2), round(mean - 1, 2), round(mean + 1, 2), None, None))
+                if len(short) >= INSERT_BATCH:
+                    flush("statistics_short_term", short)
+                if len(hourly) >= INSERT_BATCH:
+                    flush("statistics", hourly)
+        flush("statistics", hourly)
+        flush("statistics_short_term", short)
+    conn.commit()
+    conn.close()
+    return {"path": path, "schema": schema, "entities": entities, "meters": n_meters, "hours": hours,
+            "rows": rows, "injected_jumps": injected, "bytes": os.path.getsize(path)}
+
+def timed(fn, *args, **kw):
+    # runs one operation; the log lines are collected and scanned for errors
+    lines = []
+    t0 = time.perf_counter()
+    fn(*args, lines, **kw)
+    elapsed = time.perf_counter() - t0
+    errors = [line for line in lines if line.startswith("ERROR")]
+    return elapsed, errors
+
+def bench_ops(db_path, summary, repeat):
+    # preview/diagnose/apply over one month of the first meter (the one with the first jump if any);
+    # every apply is undone (timed separately) so each repeat sees the same data
+    jump = summary["injected_jumps"][0] if summary["injected_jumps"] else None
+    entity = jump["statistic_id"] if jump else "sensor.bench_energy_00001"
+    end = datetime.fromtimestamp(int(BENCH_END.timestamp()) - 15 * 86400, timezone.utc)
+    start = datetime.fromtimestamp(int(end.timestamp()) - 30 * 86400, timezone.utc)
+    start_s, end_s = start.strftime("%Y-%m-%d %H:%M"), end.strftime("%Y-%m-%d %H:%M")
+    calls = {
+        "preview": lambda: timed(fixer.preview_changes, db_path, entity, start_s, end_s, "UTC", which_cols="sum",
+                                 include_short_term=True),
+        "diagnose": lambda: timed(fixer.diagnose, db_path, entity, start_s, end_s, "UTC", which_cols="sum"),
+        "apply": lambda: timed(fixer.apply_correction, db_path, entity, start_s, "", "UTC", -1.0,
+                               which_cols="sum", include_short_term=True),
+        "undo": lambda: timed(fixer.undo_correction, db_path),
+        "backup": lambda: timed(fixer.make_backup, db_path),
+    }
+    runs = {op: [] for op in BENCH_OPS}
+    errors = {}
+    for _ in range(repeat):
+        for op in BENCH_OPS:
+            before = set(os.listdir(os.path.dirname(os.path.abspath(db_path))))
+            elapsed, errs = calls[op]()
+            runs[op].append(round(elapsed, 6))
+            if errs:
+                errors.setdefault(op, errs)
+            if op == "backup":
+                folder = os.path.dirname(os.path.abspath(db_path))
+                for name in set(os.listdir(folder)) - before:
+                    os.remove(os.path.join(folder, name))
+    return {op: {"runs": r, "min": min(r), "median": pystats.median(r), **({"errors": errors[op]} if op in errors else {})}
+            for op, r in runs.items()}
+
+def run_benchmark(sizes, schemas=SCHEMAS, years=1.0, jumps=3, repeat=3, workdir=None, keep=False):
+    # sizes: target row counts of `statistics`; entity count follows from years of hourly rows
+    results = []
+    own_dir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="ha_stats_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        for schema in schemas:
+            for size in sizes:
+                entities = max(1, round(size / (years * HOURS_PER_YEAR)))
+                db_path = os.path.join(workdir, f"bench_{schema}_{size:.0e}_{entities}x{years:g}y.db")
+                print(f"[{schema} {size:,.0f}] generating {entities} entities × {years:g} years …", file=sys.stderr)
+                t0 = time.perf_counter()
+                summary = generate_db(db_path, schema, entities, years, jumps=jumps)
+                gen_s = time.perf_counter() - t0
+                fixer.SESSIONS.clear()
+                ops = bench_ops(db_path, summary, repeat)
+                session = fixer.SESSIONS.pop(os.path.abspath(db_path), None)
+                if session:
+                    session.close()
+                results.append({"schema": schema, "target_rows": int(size), "entities": entities, "years": years,
+                                "rows": summary["rows"], "db_bytes": summary["bytes"], "generate_s": round(gen_s, 3),
+                                "ops": ops})
+                print(f"[{schema} {size:,.0f}] " + "  ".join(f"{op} {v['median'] * 1000:,.1f} ms" for op, v in ops.items()),
+                      file=sys.stderr)
+                if not keep:
+                    for path in (db_path, fixer.journal_path(db_path)):
+                        if os.path.exists(path):
+                            os.remove(path)
+    finally:
+        if own_dir and not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": getattr(fixer.np, "__version__", None),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+SPIKE_CASES = (
+    [0] * 20 + [50, -50] + [0] * 20,          # adjacent opposite outliers: neither is isolated
+    [0] * 20 + [50] + [0] * 20,               # one isolated outlier
+    [0] * 20 + [50, 50] + [0] * 20,           # plateau of two rows
+    [0] * 10 + [50] + [0] * 5 + [None] + [-40] + [0] * 10,
+)
+
+def spike_series(rnd, n):
+    # a flat-ish signal with random isolated, paired and gap-adjacent outliers
+    values = [rnd.gauss(20, 0.5) for _ in range(n)]
+    for _ in range(max(1, n // 20)):
+        i = rnd.randrange(1, n - 2)
+        if values[i] is None or values[i + 1] is None:
+            continue
+        kind = rnd.random()
+        values[i] += rnd.choice((-1, 1)) * rnd.uniform(5, 60)
+        if kind < 0.4:
+            values[i + 1] += rnd.choice((-1, 1)) * rnd.uniform(5, 60)
+        elif kind < 0.5:
+            values[i + 1] = None
+    return values
+
+def check_spikes(series=500, length=200, seed=1):
+    # both find_spikes paths must pick the same rows and replacements
+    if fixer.np is None:
+        raise RuntimeError("numpy is not installed, only the pure Python path is available")
+    rnd = random.Random(seed)
+    cases = list(SPIKE_CASES) + [spike_series(rnd, length) for _ in range(series)]
+    np_mod, mismatches = fixer.np, []
+    for n, values in enumerate(cases):
+        times = [3600 * i + (rnd.randrange(60) if n % 2 else 0) for i in range(len(values))]
+        for t in (None, times):
+            fast = fixer.find_spikes(values, t)
+            try:
+                fixer.np = None
+                slow = fixer.find_spikes(values, t)
+            finally:
+                fixer.np = np_mod
+            if fast[0] != slow[0] or any(not math.isclose(a, b, abs_tol=1e-9) for a, b in zip(fast[1], slow[1])):
+                mismatches.append({"case": n, "times": t is not None, "numpy": fast[0], "python": slow[0]})
+    if not fixer.find_spikes(SPIKE_CASES[0]) == ([], []):
+        mismatches.append({"case": 0, "times": False, "expected": []})
+    return {"cases": len(cases), "mismatches": mismatches}
+
+def parse_sizes(text):
+    return [int(float(s)) for s in text.split(",") if s.strip()]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Synthetic recorder DB generator and benchmark for ha_stats_fixer.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    g = sub.add_parser("generate", help="write a synthetic home-assistant_v2.db")
+    g.add_argument("path")
+    g.add_argument("--schema", choices=SCHEMAS, default="ts")
+    g.add_argument("--entities", type=int, default=10)
+    g.add_argument("--years", type=float, default=1.0)
+    g.add_argument("--short-term-days", type=float, default=SHORT_TERM_DAYS)
+    g.add_argument("--jumps", type=int, default=3)
+    g.add_argument("--seed", type=int, default=1)
+    r = sub.add_parser("run", help="time preview/diagnose/apply/undo/backup at several DB sizes")
+    r.add_argument("--rows", type=parse_sizes, default=parse_sizes("1e5,1e6"), help="comma separated, e.g. 1e5,1e6,1e7,1e8")
+    r.add_argument("--schema", choices=SCHEMAS + ("both",), default="both")
+    r.add_argument("--years", type=float, default=1.0)
+    r.add_argument("--jumps", type=int, default=3)
+    r.add_argument("--repeat", type=int, default=3)
+    r.add_argument("--workdir", help="keep generated DBs here instead of a temp dir")
+    r.add_argument("--keep", action="store_true", help="do not delete generated DBs")
+    r.add_argument("--out", default="-", help="JSON output file (default: stdout)")
+    c = sub.add_parser("check-spikes", help="compare the numpy and pure Python spike detection")
+    c.add_argument("--series", type=int, default=500)
+    c.add_argument("--length", type=int, default=200)
+    c.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "generate":
+        summary = generate_db(args.path, args.schema, args.entities, args.years, args.short_term_days, args.jumps, args.seed)
+        print(json.dumps(summary, indent=2))
+        return 0
+    if args.cmd == "check-spikes":
+        result = check_spikes(args.series, args.length, args.seed)
+        print(json.dumps(result, indent=2))
+        return 1 if result["mismatches"] else 0
+    schemas = SCHEMAS if args.schema == "both" else (args.schema,)
+    report = run_benchmark(args.rows, schemas, args.years, args.jumps, args.repeat, args.workdir, args.keep)
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
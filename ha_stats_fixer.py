@@ -3,26 +3,304 @@
 # - monthly Start/End window, choose columns: sum/state/both
 # - NEW: Preview & Diagnose render ONLY the columns selected in "Columns to adjust"
 #        (if "both", they render both; else only the chosen one)
+# - "Scan for jumps" ranks suspicious sum/state steps across all statistic_ids
+#   (incremental: <db>.scan.sqlite remembers the last scanned row per series, writes invalidate it)
+# - batch corrections (GUI list or CSV/JSON file) applied set-based in one transaction
+# - backups via the SQLite online backup API with progress, optional gzip/zstd compression
+# - row-level undo journal (<db>.undo.sqlite) instead of a full DB copy per apply
+# - DB operations run on a worker thread with progress bar and Cancel (rolls back)
+# - persistent per-DB session: read-only previews, cached schema and statistic_id map
+# - entity autocomplete from an in-memory prefix/trigram index of statistics_meta
+# - buffered log pane (batched inserts, capped widget, full export)
+# - "Browse rows…": lazily paged Treeview (keyset pagination) with state/sum deltas
+# - "Rebase sum": one-query load, bad steps (resets/spikes) clamped, sum re-accumulated, changed rows only
+# - "Repair spikes": isolated state/mean/min/max outliers interpolated, one UPDATE ... FROM per table
+# - chunked apply: bounded start_ts chunks, commit + WAL truncate per chunk, resumable from a checkpoint
+# - opt-in query trace: time, rows and EXPLAIN QUERY PLAN per statement, flags scans/temp B-trees
+# - "Dry run": LAG-window diff of hourly/daily/monthly consumption before vs after, boundary deltas
+# - "Check short-term": last 5-minute row per hour vs the hourly row, one grouped query
+# - "Working copy": DB or selected entities in RAM (memdb), "Commit to disk" writes changed rows only
+# - row times in local time of the chosen zone (cached UTC-offset transition tables, vectorized lookup);
+#   DST-ambiguous / nonexistent START/END reported, "±HH:MM" suffix picks the occurrence
+# - headless: command line with JSON output (`--help`), several DB files in a process pool;
+#   the operations take a list (or None) instead of the log widget and return structured results
 #
 # Close Home Assistant before applying changes.
 
+import argparse
+import bisect
+import csv
+import gzip
+import json
+import math
 import os
+import queue
+import re
 import shutil
 import sqlite3
+import statistics as pystats
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from urllib.request import pathname2url
 from zoneinfo import ZoneInfo
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+try:
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox, simpledialog
+except ImportError:  # headless: command line and library use only
+    tk = ttk = filedialog = messagebox = simpledialog = None
+
+try:
+    import numpy as np
+except ImportError:  # optional: scans fall back to plain Python
+    np = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd backup compression
+    zstandard = None
 
 APP_TITLE = "HA Statistics Fixer (SQLite) v10"
 DEFAULT_TZ = "Europe/Berlin"
 
+# Jump scan: a step is suspicious when it is SCAN_FACTOR times larger than the
+# entity's typical step (median absolute delta) and at least SCAN_MIN_DELTA.
+SCAN_FACTOR = 25.0
+SCAN_MIN_DELTA = 1.0
+SCAN_TOP_N = 50
+SCAN_BATCH_ROWS = 50000
+
+# Scan cache: the steps of the cached history are kept as a histogram with
+# log-spaced buckets (relative width SKETCH_ACCURACY) that new steps merge into.
+# The cached typical step and scale are its medians, so they stay within
+# SKETCH_ACCURACY of the exact medians of all steps; |steps| up to SKETCH_ZERO count as 0.
+# New rows are judged against the history before them, an uncached scan against the
+# whole series, so hits near the cached/new border can still differ.
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_ZERO = 1e-9
+
+# Rebase sum: bad steps (jumps by the scan rule, optionally any decrease) are
+# replaced by the typical step or by zero before the sum is re-accumulated.
+REBASE_MODES = ["typical", "zero"]
+REBASE_EPSILON = 1e-9
+
+# Spike repair: a row is an isolated spike when the step into it and the step out
+# of it both break the scan rule, in opposite directions, and the smaller one is at
+# least SPIKE_RETURN_SHARE of the larger (the series comes back); its neighbours
+# must not be spikes themselves. Replaced by linear interpolation over time.
+SPIKE_COLUMNS = ("state", "mean", "min", "max")
+SPIKE_RETURN_SHARE = 0.5
+SPIKE_LIST_N = 20
+
+# Numeric value columns of statistics rows: what the undo journal and a working copy keep.
+VALUE_COLUMNS = ("sum", "state", "mean", "min", "max")
+
+# Chunked apply: rows per committed chunk (bounded by start_ts / start)
+APPLY_CHUNK_ROWS = 20000
+
+# Dry-run diff: period buckets (strftime formats, local time); the report covers
+# the whole local months of START and END.
+DIFF_PERIODS = (("hourly", "%Y-%m-%d %H:00"), ("daily", "%Y-%m-%d"), ("monthly", "%Y-%m"))
+DIFF_EPSILON = 1e-9
+
+# Short-term consistency: max |difference| between the last 5-minute row of an
+# hour and the hourly row before the hour counts as divergent; hours listed.
+CONSISTENCY_TOLERANCE = 1e-3
+CONSISTENCY_LIST_N = 30
+
+BACKUP_PAGES_PER_STEP = 4096
+BACKUP_COMPRESSIONS = ["none", "gzip", "zstd"]
+BACKUP_MODES = ["off"] + BACKUP_COMPRESSIONS  # GUI: "off" = undo journal only
+COPY_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Entity autocomplete: max suggestions, and the share of a query's trigrams a
+# statistic_id must contain to count as a fuzzy match.
+SUGGEST_LIMIT = 25
+FUZZY_MIN_SHARE = 0.6
+
+# Log pane: buffered lines are written every LOG_FLUSH_MS; the widget keeps the
+# last LOG_MAX_LINES, the complete log stays exportable.
+LOG_FLUSH_MS = 100
+LOG_MAX_LINES = 5000
+
+# Row browser: rows fetched per keyset page, and how close to the end of the
+# loaded rows (fraction of the scroll range) the next page is requested.
+BROWSE_PAGE_ROWS = 500
+BROWSE_PREFETCH_AT = 0.9
+
+# Background operations: SQLite calls the progress handler every
+# PROGRESS_OPCODES VM instructions; the GUI polls UI_QUEUE every UI_POLL_MS.
+PROGRESS_OPCODES = 20000
+UI_POLL_MS = 50
+UI_QUEUE = queue.Queue()
+ACTIVE_TASK = None
+
+# Query trace (opt-in): statements that get an EXPLAIN QUERY PLAN, plan fragments
+# that are flagged, and how many of the slowest statements each summary lists.
+QUERY_TRACE = None
+TRACE_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "INSERT", "DELETE", "REPLACE")
+TRACE_FLAGS = (("SCAN ", "full scan"), ("TEMP B-TREE", "temp b-tree"))
+TRACE_TOP_N = 8
+TRACE_MODES = ["off", "log", "log + JSON"]
+
+# Headless runs (command line, library callers) answer confirmations with CONFIRM
+# instead of a dialog; None = ask in the GUI.
+CONFIRM = None
+
+# Command line: worker processes when several DB files are given.
+CLI_JOBS = min(4, os.cpu_count() or 1)
+
+# Local time: ZoneInfo objects and UTC-offset transition tables per zone name.
+# Inputs may carry an offset ("2025-10-26 02:30+01:00") to pick one occurrence
+# of a time that is ambiguous when DST ends.
+ZONES = {}
+CLOCKS = {}
+LOCAL_OFFSET_RE = re.compile(r"([+-])(\d{2}):(\d{2})$")
+
+class OperationCancelled(Exception):
+    pass
+
+class TaskState:
+    def __init__(self, label):
+        self.label = label
+        self.cancel_event = threading.Event()
+        self.fraction = None  # None = unknown total, progress bar runs indeterminate
+        self.ticks = 0
+        self.started = time.monotonic()
+
+def on_ui_thread():
+    return threading.current_thread() is threading.main_thread()
+
+def ui_call(fn, *args):
+    # run a Tk call (e.g. a dialog) on the main thread and wait for its result
+    if on_ui_thread():
+        return fn(*args)
+    done = threading.Event()
+    box = []
+    UI_QUEUE.put(("call", fn, args, box, done))
+    done.wait()
+    return box[0] if box else None
+
+def ask_yes_no(title, message):
+    if CONFIRM is not None or messagebox is None:
+        return bool(CONFIRM)
+    return ui_call(messagebox.askyesno, title, message)
+
+def sqlite_progress():
+    # installed on every connection; a non-zero return interrupts the running statement.
+    # Tasks run on worker threads: reads on the UI thread (row browser, entity suggestions)
+    # are never interrupted by cancelling a task
+    task = ACTIVE_TASK
+    if task is None or on_ui_thread():
+        return 0
+    task.ticks += 1
+    return 1 if task.cancel_event.is_set() else 0
+
+def report_progress(done, total):
+    task = ACTIVE_TASK
+    if task is not None and total:
+        task.fraction = min(done / total, 1.0)
+
+def check_cancelled():
+    task = ACTIVE_TASK
+    if task is not None and task.cancel_event.is_set():
+        raise OperationCancelled("cancelled by user")
+
 def log(msg, textbox):
+    if textbox is None:
+        return
+    if isinstance(textbox, (LogPane, list)):
+        textbox.append(msg)  # LogPane: rendered on the next flush; list: headless callers collect lines
+        return
+    if not on_ui_thread():
+        UI_QUEUE.put(("log", textbox, msg))
+        return
     textbox.configure(state="normal")
     textbox.insert(tk.END, msg + "\n")
     textbox.see(tk.END)
     textbox.configure(state="disabled")
 
+class LogPane:
+    # Buffered sink for log(): lines from any thread are queued and written to the
+    # Text widget with one insert per flush. The widget is capped at LOG_MAX_LINES;
+    # every line is also spooled to a temp file so the full log can be exported.
+    def __init__(self, root, text):
+        self.root = root
+        self.text = text
+        self.pending = deque()
+        self.spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.total = 0
+        root.after(LOG_FLUSH_MS, self.flush_loop)
+
+    def append(self, msg):
+        self.pending.append(msg)
+
+    def flush(self):
+        lines = []
+        while self.pending:
+            lines.append(self.pending.popleft())
+        if not lines:
+            return
+        chunk = "\n".join(lines) + "\n"
+        self.spool.write(chunk)
+        self.total += chunk.count("\n")
+        if len(lines) > LOG_MAX_LINES:
+            chunk = "\n".join(lines[-LOG_MAX_LINES:]) + "\n"
+        follow = self.text.yview()[1] >= 0.999  # keep the user's scroll position
+        self.text.configure(state="normal")
+        self.text.insert(tk.END, chunk)
+        excess = int(self.text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.text.delete("1.0", f"{excess + 1}.0")
+        if follow:
+            self.text.see(tk.END)
+        self.text.configure(state="disabled")
+
+    def flush_loop(self):
+        try:
+            self.flush()
+        finally:
+            self.root.after(LOG_FLUSH_MS, self.flush_loop)
+
+    def clear(self):
+        # clears the view only; export still contains everything
+        self.flush()
+        self.text.configure(state="normal")
+        self.text.delete("1.0", tk.END)
+        self.text.configure(state="disabled")
+
+    def export(self, path):
+        self.flush()
+        self.spool.flush()
+        self.spool.seek(0)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                shutil.copyfileobj(self.spool, f, COPY_CHUNK_BYTES)
+        finally:
+            self.spool.seek(0, os.SEEK_END)
+        return self.total
+
+def on_export_log(pane):
+    path = filedialog.asksaveasfilename(
+        title="Export log",
+        defaultextension=".txt",
+        initialfile=f"ha_stats_fixer-{datetime.now().strftime('%Y%m%d-%H%M%S')}.log",
+        filetypes=[("Text", "*.txt *.log"), ("All files", "*.*")],
+    )
+    if not path:
+        return
+    try:
+        n = pane.export(path)
+        log(f"Exported {n} log lines to {path}", pane)
+    except Exception as e:
+        log(f"ERROR exporting log: {e}", pane)
+
 def pick_db_path(entry):
     path = filedialog.askopenfilename(
         title="Select home-assistant_v2.db",
@@ -32,57 +310,915 @@ def pick_db_path(entry):
         entry.delete(0, tk.END)
         entry.insert(0, path)
 
-def make_backup(db_path, textbox):
+def open_compressed(path, compression):
+    # binary write stream of a .gz/.zst backup
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(open(path, "wb"))
+    raise ValueError(f"Unknown compression: {compression}")
+
+def stream_db_file(src, db_path, dst_path, compression, page_size, progress):
+    # once the WAL is checkpointed into it and writers are held off, the DB file itself is a
+    # consistent copy and goes straight into the compressor; False if another connection keeps
+    # the WAL busy or holds the write lock
+    busy = src.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()[0]
+    try:
+        src.execute("BEGIN IMMEDIATE;")
+    except sqlite3.OperationalError:
+        return False
+    try:
+        total = src.execute("PRAGMA page_count;").fetchone()[0]
+        wal = db_path + "-wal"
+        if busy or (os.path.exists(wal) and os.path.getsize(wal)):
+            return False
+        remaining = total * page_size
+        with open(db_path, "rb") as f, open_compressed(dst_path, compression) as dst:
+            while remaining:
+                chunk = f.read(min(COPY_CHUNK_BYTES, remaining))
+                if not chunk:
+                    raise OSError(f"{db_path} is shorter than its {total} pages")
+                dst.write(chunk)
+                remaining -= len(chunk)
+                progress(0, remaining // page_size, total)
+        return True
+    finally:
+        src.rollback()
+
+def make_backup(db_path, textbox, compression="none"):
+    # written to <backup>.tmp and renamed on success. Uncompressed: SQLite online backup (includes
+    # committed -wal content), copied in page batches. Compressed: the DB file is streamed into the
+    # compressor; only if its WAL cannot be checkpointed is an uncompressed copy staged first.
+    tmp_paths = []
     try:
         if not os.path.isfile(db_path):
             raise FileNotFoundError("DB file not found")
+        compression = compression or "none"
+        if compression not in BACKUP_COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package (pip install zstandard)")
         ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-        backup_path = f"{db_path}.{ts}.bak"
-        shutil.copy2(db_path, backup_path)
+        raw_path = f"{db_path}.{ts}.bak"
+        backup_path = raw_path + {"none": "", "gzip": ".gz", "zstd": ".zst"}[compression]
+        tmp_path = backup_path + ".tmp"
+        tmp_paths.append(tmp_path)
+
+        src = sqlite3.connect(db_path)
+        try:
+            page_size = src.execute("PRAGMA page_size;").fetchone()[0]
+            started = time.monotonic()
+            last = [started, -1, 0]
+
+            def progress(status, remaining, total):
+                check_cancelled()
+                report_progress(total - remaining, total)
+                last[2] = total
+                now = time.monotonic()
+                pct = int(100 * (total - remaining) / total) if total else 100
+                if remaining and (now - last[0] < 1.0 or pct == last[1]):
+                    return
+                last[0], last[1] = now, pct
+                mb = (total - remaining) * page_size / 1e6
+                rate = mb / max(now - started, 1e-6)
+                log(f"  backup {pct:3d}%  {mb:,.0f}/{total * page_size / 1e6:,.0f} MB  {rate:,.0f} MB/s", textbox)
+
+            def backup_pages(target):
+                dst = sqlite3.connect(target)
+                try:
+                    src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+                finally:
+                    dst.close()
+
+            if compression == "none":
+                backup_pages(tmp_path)
+            elif not stream_db_file(src, db_path, tmp_path, compression, page_size, progress):
+                log("  WAL in use by another connection, staging an uncompressed copy before compressing", textbox)
+                staged = raw_path + ".tmp"
+                tmp_paths.append(staged)
+                backup_pages(staged)
+                with open(staged, "rb") as f, open_compressed(tmp_path, compression) as dst:
+                    while True:
+                        check_cancelled()
+                        chunk = f.read(COPY_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+        finally:
+            src.close()
+
+        os.replace(tmp_path, backup_path)
+        if compression != "none":
+            size = os.path.getsize(backup_path)
+            log(f"  compressed ({compression}) {last[2] * page_size / 1e6:,.0f} MB → {size / 1e6:,.0f} MB "
+                f"in {time.monotonic() - started:.1f}s", textbox)
         log(f"Backup created: {backup_path}", textbox)
         return backup_path
+    except OperationCancelled:
+        log("Backup cancelled, partial backup file removed.", textbox)
+        raise
     except Exception as e:
         log(f"ERROR creating backup: {e}", textbox)
         return None
+    finally:
+        for path in tmp_paths:
+            if os.path.exists(path):
+                os.remove(path)
 
 def parse_local(dt_str, tz_str):
+    # "YYYY-MM-DD HH:MM[:SS][±HH:MM]" in tz_str; the offset picks one occurrence of an ambiguous time
     if not dt_str or not dt_str.strip():
         return None
-    return datetime.strptime(dt_str.strip(), "%Y-%m-%d %H:%M").replace(tzinfo=ZoneInfo(tz_str))
+    text = dt_str.strip()
+    suffix = LOCAL_OFFSET_RE.search(text)
+    if suffix:
+        text = text[:suffix.start()]
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S"):
+        try:
+            local = datetime.strptime(text, fmt).replace(tzinfo=get_zone(tz_str))
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(f"Invalid time {dt_str.strip()!r}, expected YYYY-MM-DD HH:MM[:SS][±HH:MM]")
+    if suffix:
+        sign = -1 if suffix.group(1) == "-" else 1
+        wanted = sign * (int(suffix.group(2)) * 3600 + int(suffix.group(3)) * 60)
+        for fold in (0, 1):
+            if local.replace(fold=fold).utcoffset().total_seconds() == wanted:
+                return local.replace(fold=fold)
+        raise ValueError(f"{dt_str.strip()!r}: UTC{suffix.group(0)} does not occur at this time in {tz_str}")
+    return local
+
+def get_zone(tz_str):
+    zone = ZONES.get(tz_str)
+    if zone is None:
+        zone = ZONES[tz_str] = ZoneInfo(tz_str)
+    return zone
+
+def dst_note(label, local_dt, tz_str):
+    # explains a local time that occurs twice (DST ends) or not at all (DST starts); None otherwise
+    if local_dt is None:
+        return None
+    first, second = local_dt.replace(fold=0), local_dt.replace(fold=1)
+    if first.utcoffset() == second.utcoffset():
+        return None
+    wall = local_dt.strftime("%Y-%m-%d %H:%M")
+    used = local_dt.astimezone(timezone.utc)
+    if first.astimezone(timezone.utc).astimezone(local_dt.tzinfo).replace(tzinfo=None) != local_dt.replace(tzinfo=None):
+        real = used.astimezone(local_dt.tzinfo)
+        return (f"NOTE: {label} {wall} does not exist in {tz_str} (clocks skip it when DST starts); "
+                f"used {used:%H:%M} UTC = {real:%H:%M}{fmt_offset(real.utcoffset().total_seconds())} local.")
+    other = second if local_dt.fold == 0 else first
+    mine_off, other_off = fmt_offset(local_dt.utcoffset().total_seconds()), fmt_offset(other.utcoffset().total_seconds())
+    return (f"NOTE: {label} {wall} is ambiguous in {tz_str} (occurs twice when DST ends); "
+            f"used {wall}{mine_off} = {used:%H:%M} UTC, the other is {wall}{other_off} = "
+            f"{other.astimezone(timezone.utc):%H:%M} UTC (append the offset to choose it).")
+
+def local_range(start_local_str, end_local_str, tz_str, textbox, label=""):
+    # parsed START/END; DST-ambiguous or nonexistent inputs are reported in the log
+    start_local = parse_local(start_local_str, tz_str) if start_local_str else None
+    end_local = parse_local(end_local_str, tz_str) if end_local_str else None
+    for name, local_dt in ((f"{label}START", start_local), (f"{label}END", end_local)):
+        note = dst_note(name, local_dt, tz_str)
+        if note:
+            log(note, textbox)
+    return start_local, end_local
+
+def fmt_offset(seconds):
+    sign = "-" if seconds < 0 else "+"
+    minutes = int(abs(seconds)) // 60
+    return f"{sign}{minutes // 60:02d}:{minutes % 60:02d}"
+
+class LocalClock:
+    # UTC-offset transition table of one zone (transition epochs and the offset valid
+    # from each), built per whole year on demand. Epochs are converted to local wall time
+    # with one searchsorted lookup instead of a datetime object per row. The table is
+    # published as one tuple, so readers never mix the lists/arrays of two rebuilds.
+    def __init__(self, tz_str):
+        self.zone = get_zone(tz_str)
+        self.lock = threading.Lock()
+        self.first_year = self.last_year = None
+        self.table = None  # (starts, offsets, starts_np, offsets_np, labels_np)
+
+    def year_start(self, year):
+        return int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+
+    def offset_at(self, epoch):
+        return int(datetime.fromtimestamp(epoch, self.zone).utcoffset().total_seconds())
+
+    def cover(self, lo, hi):
+        # the table, spanning at least the epochs lo..hi
+        lo_year = min(max(datetime.fromtimestamp(int(lo), timezone.utc).year, 1970), 9998)
+        hi_year = min(max(datetime.fromtimestamp(int(hi), timezone.utc).year, 1970), 9998)
+        with self.lock:
+            if self.first_year is not None and self.first_year <= lo_year and hi_year <= self.last_year:
+                return self.table
+            first = lo_year if self.first_year is None else min(lo_year, self.first_year)
+            last = hi_year if self.last_year is None else max(hi_year, self.last_year)
+            starts, offsets = [self.year_start(first)], [self.offset_at(self.year_start(first))]
+            t, end = starts[0], self.year_start(last + 1)
+            while t < end:
+                nxt = min(t + 86400, end)
+                if self.offset_at(nxt) != offsets[-1]:
+                    # bisect the day to the second of the switch
+                    a, b = t, nxt
+                    while b - a > 1:
+                        mid = (a + b) // 2
+                        if self.offset_at(mid) == offsets[-1]:
+                            a = mid
+                        else:
+                            b = mid
+                    starts.append(b)
+                    offsets.append(self.offset_at(b))
+                t = nxt
+            if np is not None:
+                arrays = (np.asarray(starts, dtype=np.int64), np.asarray(offsets, dtype=np.int64),
+                          np.asarray([fmt_offset(o) for o in offsets]))
+            else:
+                arrays = (None, None, None)
+            self.table = (starts, offsets) + arrays
+            self.first_year, self.last_year = first, last
+            return self.table
+
+    def format(self, epochs):
+        # epochs -> ["YYYY-MM-DD HH:MM:SS±HH:MM"] in local time
+        if not len(epochs):
+            return []
+        if np is not None:
+            e = np.floor(np.asarray(epochs, dtype=float)).astype(np.int64)
+            _, _, starts_np, offsets_np, labels_np = self.cover(e.min(), e.max())
+            idx = np.maximum(np.searchsorted(starts_np, e, side="right") - 1, 0)
+            wall = np.datetime_as_string((e + offsets_np[idx]).astype("datetime64[s]"), unit="s")
+            return np.char.add(np.char.replace(wall, "T", " "), labels_np[idx]).tolist()
+        e = [int(x // 1) for x in epochs]
+        starts, offsets = self.cover(min(e), max(e))[:2]
+        out = []
+        for x in e:
+            offset = offsets[max(bisect.bisect_right(starts, x) - 1, 0)]
+            wall = datetime.fromtimestamp(x + offset, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            out.append(wall + fmt_offset(offset))
+        return out
+
+    def offset_sql(self, epoch_sql, lo, hi):
+        # SQL expression: UTC offset in seconds for epoch_sql, for epochs in lo..hi
+        starts, offsets = self.cover(lo, hi)[:2]
+        i = max(bisect.bisect_right(starts, lo) - 1, 0)
+        j = bisect.bisect_right(starts, hi)
+        cases = " ".join(f"WHEN {epoch_sql} >= {starts[k]} THEN {offsets[k]}" for k in range(j - 1, i, -1))
+        return f"(CASE {cases} ELSE {offsets[i]} END)" if cases else str(offsets[i])
+
+def local_clock(tz_str):
+    clock = CLOCKS.get(tz_str)
+    if clock is None:
+        clock = CLOCKS.setdefault(tz_str, LocalClock(tz_str))
+    return clock
+
+def legacy_epochs(values):
+    # legacy DATETIME text ("YYYY-MM-DD HH:MM:SS...", UTC) -> epoch seconds
+    if np is not None:
+        return np.asarray([str(v)[:19] for v in values], dtype="datetime64[s]").astype(np.int64)
+    return [int(datetime.fromisoformat(str(v)[:19]).replace(tzinfo=timezone.utc).timestamp()) for v in values]
+
+def local_times(values, tz_str, use_ts=True):
+    # start_ts epochs (or legacy start text) -> local time strings in tz_str, one vectorized lookup
+    values = list(values)
+    if not values:
+        return []
+    return local_clock(tz_str).format(values if use_ts else legacy_epochs(values))
 
 def to_utc_forms(local_dt):
-    utc_dt = local_dt.astimezone(ZoneInfo("UTC"))
+    utc_dt = local_dt.astimezone(timezone.utc)
     plain = utc_dt.strftime("%Y-%m-%d %H:%M:%S")
     with_tz = plain + "+00:00"
     epoch = int(utc_dt.timestamp())
     return utc_dt, plain, with_tz, epoch
 
-def ensure_connection(db_path):
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA journal_mode=WAL;")
+class QueryTrace:
+    # Opt-in statement log ("Query trace"): wall time (execute + fetch), rows and the
+    # EXPLAIN QUERY PLAN of every statement run through a TracedCursor, grouped per
+    # operation (worker thread name). Full scans and temp B-tree sorts are flagged.
+    def __init__(self, json_path=None):
+        self.json_path = json_path
+        self.lock = threading.Lock()
+        self.records = []
+        self.plans = {}
+
+    def plan(self, conn, sql, params):
+        # one EXPLAIN per distinct statement text
+        if sql not in self.plans:
+            plan = []
+            if sql.lstrip().upper().startswith(TRACE_EXPLAINABLE):
+                try:
+                    plan = [r[3] for r in sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params)]
+                except sqlite3.Error as e:
+                    plan = [f"(no plan: {e})"]
+            self.plans[sql] = (plan, plan_flags(plan))
+        return self.plans[sql]
+
+    def add(self, sql, plan, flags):
+        rec = {"op": threading.current_thread().name, "sql": " ".join(sql.split()), "ms": 0.0, "rows": 0,
+               "plan": plan, "flags": flags}
+        with self.lock:
+            self.records.append(rec)
+        return rec
+
+    def report(self, textbox, op=None):
+        # per-operation summary in the log (and JSON lines when json_path is set); op=None: everything
+        with self.lock:
+            mine = [r for r in self.records if op is None or r["op"] == op]
+            self.records = [r for r in self.records if op is not None and r["op"] != op]
+        if not mine:
+            return
+        groups = {}
+        for r in mine:
+            g = groups.setdefault(r["sql"], {"sql": r["sql"], "n": 0, "ms": 0.0, "rows": 0, "plan": r["plan"], "flags": r["flags"]})
+            g["n"] += 1
+            g["ms"] += r["ms"]
+            g["rows"] += r["rows"]
+        ranked = sorted(groups.values(), key=lambda g: -g["ms"])
+        log(f"--- Query trace: {op or 'all'}: {len(mine)} statements, {sum(r['ms'] for r in mine):.1f} ms ---", textbox)
+        for g in ranked[:TRACE_TOP_N]:
+            flags = f" [{', '.join(g['flags'])}]" if g["flags"] else ""
+            log(f"  {g['ms']:9.1f} ms  ×{g['n']:<4} rows {g['rows']:<8}{flags}  {g['sql'][:160]}", textbox)
+        for g in ranked:
+            if g["flags"]:
+                log(f"  ! {', '.join(g['flags'])}: {g['sql'][:160]}", textbox)
+                for line in g["plan"]:
+                    log(f"      {line}", textbox)
+        if self.json_path:
+            try:
+                with open(self.json_path, "a", encoding="utf-8") as f:
+                    for r in mine:
+                        f.write(json.dumps(r) + "\n")
+                log(f"  trace appended to {self.json_path}", textbox)
+            except OSError as e:
+                log(f"ERROR writing query trace: {e}", textbox)
+
+def plan_flags(plan):
+    # scans of co-routines/materialized subqueries and CTEs are not table scans
+    inner = {p.split(" ", 1)[1] for p in plan if p.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+    scans = [p for p in plan if p.startswith("SCAN ") and p[5:] not in inner and not p[5:].startswith("(")]
+    return [flag for needle, flag in TRACE_FLAGS
+            if any(needle in p for p in (scans if needle == "SCAN " else plan))]
+
+class TracedCursor(sqlite3.Cursor):
+    # pass-through unless QUERY_TRACE is set
+    record = None
+
+    def execute(self, sql, params=()):
+        return self.traced(super().execute, sql, params, params)
+
+    def executemany(self, sql, seq_of_params):
+        if QUERY_TRACE is None:
+            return super().executemany(sql, seq_of_params)
+        seq_of_params = list(seq_of_params)
+        return self.traced(super().executemany, sql, seq_of_params, seq_of_params[0] if seq_of_params else ())
+
+    def traced(self, run, sql, params, sample):
+        trace = QUERY_TRACE
+        if trace is None:
+            return run(sql, params)
+        self.record = trace.add(sql, *trace.plan(self.connection, sql, sample))
+        t0 = time.perf_counter()
+        try:
+            return run(sql, params)
+        finally:
+            self.record["ms"] += (time.perf_counter() - t0) * 1000
+            self.record["rows"] = max(self.rowcount, 0)
+
+    def fetched(self, run, *args):
+        if self.record is None:
+            return run(*args)
+        t0 = time.perf_counter()
+        rows = run(*args)
+        self.record["ms"] += (time.perf_counter() - t0) * 1000
+        self.record["rows"] += len(rows) if isinstance(rows, list) else int(rows is not None)
+        return rows
+
+    def fetchone(self):
+        return self.fetched(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self.fetched(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self.fetched(super().fetchall)
+
+class TracedConnection(sqlite3.Connection):
+    # every connection of the tool; Connection.execute() bypasses cursor(), so route it explicitly
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+def set_query_trace(enabled, json_path=None, textbox=None):
+    global QUERY_TRACE
+    previous, QUERY_TRACE = QUERY_TRACE, (QueryTrace(json_path) if enabled else None)
+    if previous is not None and textbox is not None:
+        previous.report(textbox)
+
+def ensure_connection(db_path, on_disk=False):
+    # write connection (the working copy while one is open); keeps the DB's own journal mode
+    conn = sqlite3.connect(db_path if on_disk else db_target(db_path), uri=True, factory=TracedConnection)
     conn.execute("PRAGMA synchronous=NORMAL;")
     conn.execute("PRAGMA foreign_keys=ON;")
+    conn.set_progress_handler(sqlite_progress, PROGRESS_OPCODES)
     return conn
 
-def get_metadata_id(conn, entity_id):
+def legacy_start_sep(conn, table):
+    # Legacy `start` is DATETIME text ("YYYY-MM-DD HH:MM:SS[.ffffff][+00:00]").
+    # Comparing it as a plain string keeps (metadata_id, start) index range scans;
+    # only the date/time separator of the stored layout has to match the bounds.
     cur = conn.cursor()
-    cur.execute("SELECT id FROM statistics_meta WHERE statistic_id = ?;", (entity_id,))
+    cur.execute(f"SELECT start FROM {table} LIMIT 1;")
     row = cur.fetchone()
-    return row[0] if row else None
+    return "T" if row and isinstance(row[0], str) and row[0][10:11] == "T" else " "
+
+def legacy_bound(plain, sep):
+    # "YYYY-MM-DD HH:MM:SS" sorts before any stored suffix of the same second,
+    # so >= / < against it behave like datetime() comparisons
+    return plain.replace(" ", sep) if plain is not None else None
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class EntityIndex:
+    # In-memory prefix + trigram index over statistics_meta, built once per
+    # session; serves autocomplete and "similar statistic_ids" without LIKE scans.
+    def __init__(self, rows):
+        # rows: (metadata_id, statistic_id, unit, source)
+        self.rows = sorted(rows, key=lambda r: r[1].lower())
+        self.keys = [r[1].lower() for r in self.rows]
+        # "sensor.pv_meter" is also found by typing "pv_meter"
+        self.object_keys = sorted((k.split(".", 1)[-1], i) for i, k in enumerate(self.keys))
+        self.grams = {}
+        for i, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, []).append(i)
+
+    def search(self, query, limit=SUGGEST_LIMIT):
+        q = query.strip().lower()
+        if not q:
+            return self.rows[:limit]
+        hits = []
+        seen = set()
+
+        def add(i):
+            if i not in seen:
+                seen.add(i)
+                hits.append(i)
+
+        # 1. prefix of statistic_id, then prefix of the object id
+        i = bisect.bisect_left(self.keys, q)
+        while i < len(self.keys) and self.keys[i].startswith(q) and len(hits) < limit:
+            add(i)
+            i += 1
+        i = bisect.bisect_left(self.object_keys, (q,))
+        while i < len(self.object_keys) and self.object_keys[i][0].startswith(q) and len(hits) < limit:
+            add(self.object_keys[i][1])
+            i += 1
+
+        # 2. substring: only ids holding the query's rarest trigram can match
+        grams = sorted(trigrams(q), key=lambda g: len(self.grams.get(g, ())))
+        if len(hits) < limit:
+            candidates = self.grams.get(grams[0], []) if grams else range(len(self.keys))
+            for i in candidates:
+                if q in self.keys[i]:
+                    add(i)
+                    if len(hits) >= limit:
+                        break
+
+        # 3. fuzzy (typos, only when nothing matched literally): ids sharing at least
+        # `need` trigrams, best first; such an id holds one of the len(grams) - need + 1 rarest
+        if not hits and grams:
+            need = max(1, int(len(grams) * FUZZY_MIN_SHARE))
+            pool = set()
+            for gram in grams[:len(grams) - need + 1]:
+                pool.update(self.grams.get(gram, ()))
+            pool.difference_update(seen)
+            scored = sorted((-sum(g in self.keys[i] for g in grams), i) for i in pool)
+            for n, i in scored:
+                if -n < need or len(hits) >= limit:
+                    break
+                add(i)
+        return [self.rows[i] for i in hits[:limit]]
+
+def file_signature(db_path):
+    sig = []
+    for suffix in ("", "-wal"):
+        try:
+            st = os.stat(db_path + suffix)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+class StatsSession:
+    # One per DB file: a persistent read-only connection for previews and
+    # diagnostics plus cached schema capabilities and the statistic_id map.
+    # Write connections are opened only while applying (ensure_connection).
+    # Caches are checked whenever PRAGMA data_version says another connection
+    # committed: columns/separators follow schema_version, the statistic_id map
+    # and entity index follow statistics_meta (row count and highest id), so
+    # HA's regular inserts into statistics keep them.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = None
+        self.identity = None
+        self.data_version = None
+        self.schema_version = None
+        self.meta_mark = None
+        self.columns = {}
+        self.seps = {}
+        self.meta = None
+        self.index = None
+
+    def file_identity(self):
+        st = os.stat(self.db_path)
+        return st.st_dev, st.st_ino
+
+    def read(self):
+        with self.lock:
+            if not os.path.isfile(self.db_path):
+                raise FileNotFoundError("DB file not found")
+            wc = working_copy(self.db_path)
+            if self.conn is not None and wc is None and self.file_identity() != self.identity:
+                # file replaced (e.g. a backup restored): the connection still reads the old one
+                self.conn.close()
+                self.conn = None
+            if self.conn is None:
+                uri = wc.uri if wc else "file:" + pathname2url(os.path.abspath(self.db_path)) + "?mode=ro"
+                self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256, factory=TracedConnection)
+                self.conn.set_progress_handler(sqlite_progress, PROGRESS_OPCODES)
+                self.identity = None if wc else self.file_identity()
+                self.data_version = self.schema_version = self.meta_mark = None
+            version = self.conn.execute("PRAGMA data_version;").fetchone()[0]
+            if version != self.data_version:
+                self.revalidate()
+                self.data_version = version
+            return self.conn
+
+    def revalidate(self):
+        schema = self.conn.execute("PRAGMA schema_version;").fetchone()[0]
+        if schema != self.schema_version:
+            self.columns.clear()
+            self.seps.clear()
+            self.meta = self.index = self.meta_mark = None
+            self.schema_version = schema
+        try:
+            mark = self.conn.execute("SELECT COUNT(*), MAX(id) FROM statistics_meta;").fetchone()
+        except sqlite3.OperationalError:
+            mark = None
+        if mark != self.meta_mark:
+            self.meta = self.index = None
+            self.meta_mark = mark
+
+    @contextmanager
+    def reading(self):
+        with self.lock:
+            yield self.read()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def has_column(self, table, column):
+        with self.lock:
+            conn = self.read()
+            if table not in self.columns:
+                cur = conn.cursor()
+                cur.execute(f"PRAGMA table_info({table});")
+                self.columns[table] = {r[1] for r in cur.fetchall()}
+            return column in self.columns[table]
+
+    def time_layout(self, table):
+        # (use_start_ts, legacy separator) for range_where_clause / range_join_clause
+        with self.lock:
+            if self.has_column(table, "start_ts"):
+                return True, " "
+            if table not in self.seps:
+                self.seps[table] = legacy_start_sep(self.read(), table)
+            return False, self.seps[table]
+
+    def metadata(self):
+        with self.lock:
+            conn = self.read()
+            if self.meta is None or self.index is None:
+                unit = "unit_of_measurement" if self.has_column("statistics_meta", "unit_of_measurement") else "NULL"
+                source = "source" if self.has_column("statistics_meta", "source") else "NULL"
+                cur = conn.cursor()
+                cur.execute(f"SELECT id, statistic_id, {unit}, {source} FROM statistics_meta ORDER BY statistic_id;")
+                rows = cur.fetchall()
+                self.meta = {r[1]: r[0] for r in rows}
+                self.index = EntityIndex(rows)
+            return self.meta
+
+    def entity_index(self):
+        with self.lock:
+            self.metadata()
+            return self.index
+
+    def metadata_id(self, entity_id):
+        return self.metadata().get(entity_id)
+
+    def similar_ids(self, entity_id):
+        return [(mid, sid) for mid, sid, _, _ in self.entity_index().search(entity_id)]
+
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+def get_session(db_path):
+    key = os.path.abspath(db_path)
+    with SESSIONS_LOCK:
+        if key not in SESSIONS:
+            SESSIONS[key] = StatsSession(db_path)
+    return SESSIONS[key]
+
+def reset_session(db_path):
+    with SESSIONS_LOCK:
+        session = SESSIONS.pop(os.path.abspath(db_path), None)
+    if session is not None:
+        session.close()
+
+WORKING_COPIES = {}
+WORKING_COPY_IDS = iter(range(1, 1 << 30))
+
+class WorkingCopy:
+    # In-RAM copy of the recorder DB (or of some entities' rows) in the memdb VFS, so every
+    # connection of this process sees it; `keeper` holds it and its undo journal alive.
+    # Triggers record the first-seen values of every updated row in _wc_changed:
+    # the rows to write back on commit, and the baseline to detect changes on disk.
+    def __init__(self, db_path, entity_ids=None):
+        n = next(WORKING_COPY_IDS)
+        self.db_path = db_path
+        self.entity_ids = entity_ids
+        self.uri = f"file:/ha_stats_wc_{n}?vfs=memdb"
+        self.journal_uri = f"file:/ha_stats_wc_{n}_undo?vfs=memdb"
+        self.keeper = None
+        self.signature = None
+
+    def describe(self):
+        return "whole DB" if self.entity_ids is None else f"{len(self.entity_ids)} entities"
+
+    def pending(self):
+        return self.keeper.execute("SELECT COUNT(*) FROM _wc_changed;").fetchone()[0]
+
+def working_copy(db_path):
+    return WORKING_COPIES.get(os.path.abspath(db_path))
+
+def db_target(db_path):
+    # what connections open for db_path: the working copy while one is loaded
+    wc = working_copy(db_path)
+    return wc.uri if wc else db_path
+
+def open_working_copy(db_path, textbox, entity_ids=None):
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if sqlite3.sqlite_version_info < (3, 36, 0):
+            raise RuntimeError(f"SQLite >= 3.36 required for working copies (have {sqlite3.sqlite_version}).")
+        if working_copy(db_path):
+            log("A working copy of this DB is already open.", textbox)
+            return None
+        mids = None
+        if entity_ids:
+            meta = get_session(db_path).metadata()
+            missing = [e for e in entity_ids if e not in meta]
+            if missing:
+                log("Not in statistics_meta: " + ", ".join(missing), textbox)
+                return None
+            entity_ids = sorted(set(entity_ids))
+            mids = [meta[e] for e in entity_ids]
+
+        wc = WorkingCopy(db_path, entity_ids)
+        t0 = time.monotonic()
+        keeper = sqlite3.connect(wc.uri, uri=True, check_same_thread=False, factory=TracedConnection)
+        try:
+            keeper.set_progress_handler(sqlite_progress, PROGRESS_OPCODES)
+            signature = file_signature(db_path)
+            src = sqlite3.connect("file:" + pathname2url(os.path.abspath(db_path)) + "?mode=ro", uri=True, factory=TracedConnection)
+            try:
+                src.set_progress_handler(sqlite_progress, PROGRESS_OPCODES)
+                if mids is None:
+                    def progress(status, remaining, total):
+                        check_cancelled()
+                        report_progress(total - remaining, total)
+                    src.backup(keeper, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+                else:
+                    # only the statistics tables, and only the selected entities' rows; the copy runs
+                    # on the disk side because ATTACH inherits the VFS of the attaching connection
+                    cur = src.cursor()
+                    cur.execute(f"""
+                        SELECT sql FROM sqlite_master
+                        WHERE tbl_name IN ('statistics_meta', {', '.join(f"'{t}'" for t in STAT_TABLES)}) AND sql IS NOT NULL
+                        ORDER BY type = 'index';
+                    """)
+                    for (sql,) in cur.fetchall():
+                        keeper.execute(sql)
+                    src.execute("ATTACH DATABASE ? AS wc;", (wc.uri,))
+                    marks = ", ".join("?" * len(mids))
+                    src.execute(f"INSERT INTO wc.statistics_meta SELECT * FROM main.statistics_meta WHERE id IN ({marks});", mids)
+                    for table in STAT_TABLES:
+                        check_cancelled()
+                        src.execute(f"INSERT INTO wc.{table} SELECT * FROM main.{table} WHERE metadata_id IN ({marks});", mids)
+                    src.commit()
+            finally:
+                src.close()
+            keeper.executescript(f"""
+                CREATE TABLE _wc_changed (
+                    tbl TEXT NOT NULL, row_id INTEGER NOT NULL, {", ".join(f"{c} REAL" for c in VALUE_COLUMNS)},
+                    PRIMARY KEY (tbl, row_id)
+                ) WITHOUT ROWID;
+            """ + "".join(f"""
+                CREATE TRIGGER _wc_track_{t} AFTER UPDATE OF {", ".join(VALUE_COLUMNS)} ON {t} BEGIN
+                    INSERT OR IGNORE INTO _wc_changed VALUES ('{t}', OLD.id, {", ".join(f"OLD.{c}" for c in VALUE_COLUMNS)});
+                END;
+            """ for t in STAT_TABLES))
+            counts = {t: keeper.execute(f"SELECT COUNT(*) FROM {t};").fetchone()[0] for t in STAT_TABLES}
+            size = keeper.execute("PRAGMA page_count;").fetchone()[0] * keeper.execute("PRAGMA page_size;").fetchone()[0]
+        except Exception:
+            keeper.close()
+            raise
+        wc.keeper, wc.signature = keeper, signature
+        WORKING_COPIES[os.path.abspath(db_path)] = wc
+        attach_journal(keeper, db_path)  # in-RAM undo journal for trial corrections
+        reset_session(db_path)
+        log(f"=== Working copy loaded ({wc.describe()}): {', '.join(f'{t}={n}' for t, n in counts.items())} rows, "
+            f"{size / 1e6:,.0f} MB in {time.monotonic() - t0:.1f}s ===", textbox)
+        log("Preview, apply, batch and undo now run in RAM. \"Commit to disk\" writes the changed rows back.", textbox)
+        return wc
+    except Exception as e:
+        log(f"ERROR loading working copy: {e}", textbox)
+        return None
 
-def list_similar_ids(conn, entity_id):
-    cur = conn.cursor()
-    like = f"%{entity_id}%"
-    cur.execute("SELECT id, statistic_id FROM statistics_meta WHERE statistic_id LIKE ? ORDER BY statistic_id;", (like,))
-    return cur.fetchall()
+def log_skipped_rows(skipped, textbox):
+    for table, ids in skipped.items():
+        log(f"Skipped {len(ids)} rows of {table} that changed on disk since the working copy was loaded "
+            f"(still pending, \"Keep disk rows\" drops them): ids {', '.join(map(str, ids[:20]))}"
+            + (f" … {len(ids) - 20} more" if len(ids) > 20 else ""), textbox)
+
+def reload_from_disk(cur, table, ids):
+    # sets rows of the working copy (attached as wc to a connection on the DB file) to their disk
+    # values and drops them from _wc_changed, where the tracking trigger would record them
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS wc_reload (row_id INTEGER PRIMARY KEY);")
+    cur.execute("DELETE FROM wc_reload;")
+    cur.executemany("INSERT INTO wc_reload VALUES (?);", [(i,) for i in ids])
+    cur.execute(f"""
+        UPDATE wc.{table} AS m SET {", ".join(f"{c} = d.{c}" for c in VALUE_COLUMNS)}
+        FROM main.{table} d, wc_reload r WHERE d.id = m.id AND r.row_id = m.id;
+    """)
+    n = cur.rowcount
+    cur.execute(f"DELETE FROM wc._wc_changed WHERE tbl = '{table}' AND row_id IN (SELECT row_id FROM wc_reload);")
+    return n
+
+def commit_working_copy(db_path, textbox):
+    # writes rows whose sum/state differ from the disk back in one short transaction,
+    # journalled in the on-disk undo journal; rows changed on disk since loading are skipped
+    # and stay pending in _wc_changed, everything written is dropped from it
+    try:
+        wc = working_copy(db_path)
+        if wc is None:
+            log("No working copy open.", textbox)
+            return None
+        if file_signature(db_path) != wc.signature:
+            if not ask_yes_no("DB changed on disk", "The DB file changed since the working copy was loaded "
+                              "(is Home Assistant running?). Write anyway? Rows changed on disk are skipped."):
+                log("Aborted by user.", textbox)
+                return None
+        conn = ensure_connection(db_path, on_disk=True)
+        try:
+            conn.execute("ATTACH DATABASE ? AS wc;", (wc.uri,))
+            attach_journal(conn, db_path, on_disk=True)
+            cur = conn.cursor()
+            replay_pending(conn, db_path, textbox, on_disk=True)
+            t0 = time.monotonic()
+            conn.execute("BEGIN;")
+            journal_id = journal_start(cur, "working copy", f"working copy commit ({wc.describe()})", VALUE_COLUMNS)
+            cols = ", ".join(VALUE_COLUMNS)
+            skipped = {}
+            for table in STAT_TABLES:
+                changed = f"""
+                    wc._wc_changed c JOIN wc.{table} m ON m.id = c.row_id
+                    WHERE c.tbl = '{table}' AND d.id = c.row_id AND ({" OR ".join(f"m.{c} IS NOT d.{c}" for c in VALUE_COLUMNS)})
+                """
+                conflict = f"NOT ({' AND '.join(f'd.{c} IS c.{c}' for c in VALUE_COLUMNS)})"
+                cur.execute(f"SELECT d.id FROM main.{table} d, {changed} AND {conflict} ORDER BY d.id;")
+                ids = [r[0] for r in cur.fetchall()]
+                if ids:
+                    skipped[table] = ids
+                same_base = "".join(f" AND d.{c} IS c.{c}" for c in VALUE_COLUMNS)
+                cur.execute(f"""
+                    INSERT OR IGNORE INTO journal.rows (correction_id, tbl, row_id, {cols}, {", ".join(f"new_{c}" for c in VALUE_COLUMNS)})
+                    SELECT ?, '{table}', d.id, {", ".join(f"d.{c}" for c in VALUE_COLUMNS)}, {", ".join(f"m.{c}" for c in VALUE_COLUMNS)}
+                    FROM main.{table} d, {changed} {same_base};
+                """, (journal_id,))
+            cur.execute("SELECT COUNT(*) FROM journal.rows WHERE correction_id = ?;", (journal_id,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                if not skipped:
+                    log("Working copy has no changes against the DB file.", textbox)
+                log_skipped_rows(skipped, textbox)
+                return {}
+            conn.commit()
+            written = journal_apply(conn, db_path, journal_id, on_disk=True)
+            for table in STAT_TABLES:
+                # written rows now match the disk, the new baseline; conflicting ones stay pending
+                cur.execute(f"""
+                    DELETE FROM wc._wc_changed AS c WHERE c.tbl = '{table}'
+                    AND NOT EXISTS (SELECT 1 FROM main.{table} d, wc.{table} m
+                                    WHERE d.id = c.row_id AND m.id = c.row_id
+                                    AND ({" OR ".join(f"m.{c} IS NOT d.{c}" for c in VALUE_COLUMNS)}));
+                """)
+            conn.commit()
+            elapsed = time.monotonic() - t0
+        except Exception as e:
+            conn.rollback()
+            log(f"ERROR during commit to disk (rolled back): {e}", textbox)
+            return None
+        finally:
+            conn.close()
+        wc.signature = file_signature(db_path)
+        log(f"=== Working copy committed to disk in {elapsed:.2f}s: "
+            + ", ".join(f"{t}={n}" for t, n in written.items()) + " rows ===", textbox)
+        log_skipped_rows(skipped, textbox)
+        log(f"Undo entry #{journal_id} written to the {journal_name(db_path, on_disk=True)} "
+            "(Undo last / Undo #… on the disk journal reverts it)", textbox)
+        log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+        return written
+    except Exception as e:
+        log(f"ERROR during commit to disk: {e}", textbox)
+        return None
 
-def table_has_column(conn, table, column):
-    cur = conn.cursor()
-    cur.execute(f"PRAGMA table_info({table});")
-    cols = [r[1] for r in cur.fetchall()]
-    return column in cols
+def keep_disk_rows(db_path, textbox):
+    # resolves what Commit to disk skips in favour of the disk: pending rows changed on disk since
+    # loading get the disk values again, rows deleted on disk are dropped; neither stays pending
+    try:
+        wc = working_copy(db_path)
+        if wc is None:
+            log("No working copy open.", textbox)
+            return None
+        conn = ensure_connection(db_path, on_disk=True)
+        try:
+            conn.execute("ATTACH DATABASE ? AS wc;", (wc.uri,))
+            cur = conn.cursor()
+            conn.execute("BEGIN;")
+            reloaded, dropped = {}, {}
+            for table in STAT_TABLES:
+                cur.execute(f"""
+                    SELECT c.row_id FROM wc._wc_changed c JOIN main.{table} d ON d.id = c.row_id
+                    WHERE c.tbl = '{table}' AND NOT ({' AND '.join(f'd.{c} IS c.{c}' for c in VALUE_COLUMNS)});
+                """)
+                ids = [r[0] for r in cur.fetchall()]
+                if ids:
+                    reloaded[table] = reload_from_disk(cur, table, ids)
+                cur.execute(f"""
+                    DELETE FROM wc._wc_changed AS c WHERE c.tbl = '{table}'
+                    AND NOT EXISTS (SELECT 1 FROM main.{table} d WHERE d.id = c.row_id);
+                """)
+                if cur.rowcount:
+                    dropped[table] = cur.rowcount
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            log(f"ERROR keeping disk rows (rolled back): {e}", textbox)
+            return None
+        finally:
+            conn.close()
+        if not (reloaded or dropped):
+            log("No pending rows changed on disk.", textbox)
+            return {}
+        for table, n in reloaded.items():
+            log(f"Reloaded {n} rows of {table} from disk, their working-copy changes are dropped.", textbox)
+        for table, n in dropped.items():
+            log(f"Dropped {n} pending rows of {table} deleted on disk.", textbox)
+        log(f"{wc.pending()} rows still pending.", textbox)
+        return reloaded
+    except Exception as e:
+        log(f"ERROR keeping disk rows: {e}", textbox)
+        return None
 
-def range_where_clause(use_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch):
+def discard_working_copy(db_path, textbox):
+    wc = WORKING_COPIES.pop(os.path.abspath(db_path), None)
+    if wc is None:
+        log("No working copy open.", textbox)
+        return None
+    pending = wc.pending()
+    reset_session(db_path)
+    wc.keeper.close()
+    log(f"Working copy closed ({pending} uncommitted rows dropped). Working on the DB file again.", textbox)
+    return pending
+
+def range_where_clause(use_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch, sep=" "):
     # half-open [start, end) when end provided, else >= start
     if use_ts:
         if end_epoch is None:
@@ -90,10 +1226,172 @@ def range_where_clause(use_ts, start_plain, start_tz, start_epoch, end_plain, en
         else:
             return "metadata_id = ? AND start_ts >= ? AND start_ts < ?", lambda mid: (mid, start_epoch, end_epoch)
     else:
+        start_cmp, end_cmp = legacy_bound(start_plain, sep), legacy_bound(end_plain, sep)
         if end_plain is None:
-            return "metadata_id = ? AND datetime(start) >= datetime(?)", lambda mid: (mid, start_plain)
+            return "metadata_id = ? AND start >= ?", lambda mid: (mid, start_cmp)
         else:
-            return "metadata_id = ? AND datetime(start) >= datetime(?) AND datetime(start) < datetime(?)", lambda mid: (mid, start_plain, end_plain)
+            return "metadata_id = ? AND start >= ? AND start < ?", lambda mid: (mid, start_cmp, end_cmp)
+
+def range_join_clause(use_ts, alias, ranges, sep=" "):
+    # row alias falls inside [start, end) of a temp range row; NULL end = open-ended
+    if use_ts:
+        return (f"{alias}.metadata_id = {ranges}.metadata_id AND {alias}.start_ts >= {ranges}.start_ts"
+                f" AND ({ranges}.end_ts IS NULL OR {alias}.start_ts < {ranges}.end_ts)")
+    start_cmp, end_cmp = f"{ranges}.start_plain", f"{ranges}.end_plain"
+    if sep != " ":
+        start_cmp, end_cmp = f"replace({start_cmp}, ' ', '{sep}')", f"replace({end_cmp}, ' ', '{sep}')"
+    return (f"{alias}.metadata_id = {ranges}.metadata_id AND {alias}.start >= {start_cmp}"
+            f" AND ({ranges}.end_plain IS NULL OR {alias}.start < {end_cmp})")
+
+STAT_TABLES = ("statistics", "statistics_short_term")
+
+def journal_path(db_path, on_disk=False):
+    wc = None if on_disk else working_copy(db_path)
+    return wc.journal_uri if wc else f"{db_path}.undo.sqlite"
+
+def journal_exists(db_path, on_disk=False):
+    return (working_copy(db_path) is not None and not on_disk) or os.path.isfile(journal_path(db_path, on_disk=True))
+
+def journal_name(db_path, on_disk=False):
+    # the working copy's RAM journal numbers its entries independently of the disk journal
+    wc = None if on_disk else working_copy(db_path)
+    return "working-copy journal (RAM)" if wc else f"disk journal {journal_path(db_path, on_disk=True)}"
+
+def attach_journal(conn, db_path, on_disk=False):
+    # side-car undo journal: old values of every row a correction touches, and the new_* values
+    # it writes (must be attached outside a transaction)
+    conn.execute("ATTACH DATABASE ? AS journal;", (journal_path(db_path, on_disk),))
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS journal.corrections (
+            id INTEGER PRIMARY KEY,
+            created TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            description TEXT NOT NULL,
+            columns TEXT NOT NULL,
+            undone TEXT,
+            applied TEXT
+        );
+        CREATE TABLE IF NOT EXISTS journal.rows (
+            correction_id INTEGER NOT NULL,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            sum REAL,
+            state REAL,
+            mean REAL,
+            min REAL,
+            max REAL,
+            new_sum REAL,
+            new_state REAL,
+            new_mean REAL,
+            new_min REAL,
+            new_max REAL,
+            PRIMARY KEY (correction_id, tbl, row_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS journal.ix_rows_row ON rows (tbl, row_id);
+        CREATE TABLE IF NOT EXISTS journal.checkpoints (
+            correction_id INTEGER PRIMARY KEY,
+            params TEXT NOT NULL,
+            tbl TEXT NOT NULL,
+            next_start,
+            finished TEXT
+        );
+    """)
+    # journals written before spike repair only kept sum/state, older ones no new_* values
+    have = {r[1] for r in conn.execute("PRAGMA journal.table_info(rows);")}
+    for col in VALUE_COLUMNS + tuple(f"new_{c}" for c in VALUE_COLUMNS):
+        if col not in have:
+            conn.execute(f"ALTER TABLE journal.rows ADD COLUMN {col} REAL;")
+    if "applied" not in {r[1] for r in conn.execute("PRAGMA journal.table_info(corrections);")}:
+        # entries of older versions were written in the same transaction as their rows
+        conn.execute("ALTER TABLE journal.corrections ADD COLUMN applied TEXT;")
+        conn.execute("UPDATE journal.corrections SET applied = created;")
+        conn.commit()
+
+def journal_start(cur, kind, description, cols):
+    cur.execute(
+        "INSERT INTO journal.corrections (created, kind, description, columns) VALUES (?, ?, ?, ?);",
+        (datetime.now().isoformat(timespec="seconds"), kind, description, ",".join(cols)),
+    )
+    return cur.lastrowid
+
+def journal_rows(cur, correction_id, table, where_sql, params, cols=(), offset=0.0):
+    # old sum/state, and as new_* the journaled value + offset for cols; the first recorded row wins
+    new_sql = ", ".join(f"{c} + ?" if c in cols else c for c in ("sum", "state"))
+    cur.execute(f"""
+        INSERT OR IGNORE INTO journal.rows (correction_id, tbl, row_id, sum, state, new_sum, new_state)
+        SELECT ?, '{table}', id, sum, state, {new_sql} FROM {table} WHERE {where_sql};
+    """, (correction_id, *[offset] * sum(c in cols for c in ("sum", "state")), *params))
+    return cur.rowcount
+
+def journal_apply(conn, db_path, journal_id, on_disk=False, replay=False, check=None):
+    # second half of every write: the journal entry (old and new_* values) is committed first,
+    # then this sets its rows to new_* in one transaction on the HA DB. A transaction spanning
+    # the HA DB and the attached journal is not atomic in WAL mode; this way a crash leaves at
+    # worst an entry that is not marked applied, and replaying it writes the same values.
+    # First run: aborts (and drops the entry) if a row no longer holds its journaled old value
+    # or check(cur) raises.
+    cur = conn.cursor()
+    cur.execute("SELECT columns FROM journal.corrections WHERE id = ?;", (journal_id,))
+    cols = [c for c in cur.fetchone()[0].split(",") if c in VALUE_COLUMNS]
+    set_sql = ", ".join(f"{c} = j.new_{c}" for c in cols)
+    changed_sql = " OR ".join(f"t.{c} IS NOT j.{c}" for c in cols)
+    counts = {}
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        if check is not None:
+            check(cur)
+        cur.execute("SELECT DISTINCT tbl FROM journal.rows WHERE correction_id = ?;", (journal_id,))
+        for (table,) in cur.fetchall():
+            if table not in STAT_TABLES:
+                raise ValueError(f"Unexpected table in journal: {table}")
+            if not replay:
+                cur.execute(f"""
+                    SELECT COUNT(*) FROM journal.rows j LEFT JOIN main.{table} t ON t.id = j.row_id
+                    WHERE j.correction_id = ? AND j.tbl = ? AND (t.id IS NULL OR {changed_sql});
+                """, (journal_id, table))
+                n = cur.fetchone()[0]
+                if n:
+                    raise RuntimeError(f"{n} rows of {table} changed since they were read, nothing written")
+            cur.execute(f"""
+                UPDATE main.{table} AS t SET {set_sql} FROM journal.rows j
+                WHERE j.correction_id = ? AND j.tbl = ? AND t.id = j.row_id;
+            """, (journal_id, table))
+            counts[table] = cur.rowcount
+        invalidate_journaled(db_path, cur, journal_id, on_disk)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        if not replay:
+            journal_discard(conn, journal_id)
+        raise
+    cur.execute("UPDATE journal.corrections SET applied = ? WHERE id = ?;",
+                (datetime.now().isoformat(timespec="seconds"), journal_id))
+    conn.commit()
+    return counts
+
+def journal_discard(conn, journal_id):
+    # drops an entry whose rows were never written; not interrupted by a pending cancel
+    conn.set_progress_handler(None, 0)
+    try:
+        conn.execute("DELETE FROM journal.rows WHERE correction_id = ?;", (journal_id,))
+        conn.execute("DELETE FROM journal.corrections WHERE id = ?;", (journal_id,))
+        conn.commit()
+    finally:
+        conn.set_progress_handler(sqlite_progress, PROGRESS_OPCODES)
+
+def replay_pending(conn, db_path, textbox, on_disk=False):
+    # completes entries whose journal committed but whose rows were not written (crash in between)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.id, c.description FROM journal.corrections c
+        WHERE c.applied IS NULL AND c.undone IS NULL
+        AND NOT EXISTS (SELECT 1 FROM journal.checkpoints k WHERE k.correction_id = c.id)
+        ORDER BY c.id;
+    """)
+    for journal_id, description in cur.fetchall():
+        counts = journal_apply(conn, db_path, journal_id, on_disk, replay=True)
+        log(f"Completed interrupted correction #{journal_id} ({description}): "
+            + (", ".join(f"{t}={n}" for t, n in counts.items()) or "no rows"), textbox)
 
 def build_column_select(which_cols):
     if which_cols == "sum":
@@ -103,32 +1401,43 @@ def build_column_select(which_cols):
     else:  # both
         return ("state, sum", ["state", "sum"])
 
+def row_records(rows, col_list, tz_str, use_ts):
+    # (time, *values) rows -> [{"time": local time, column: value}] for structured results
+    times = local_times([row[0] for row in rows], tz_str, use_ts)
+    return [dict(zip(["time"] + col_list, (t, *row[1:]))) for t, row in zip(times, rows)]
+
 def preview_changes(db_path, entity_id, start_local_str, end_local_str, tz_str, textbox, which_cols, include_short_term=False):
     try:
         if not os.path.isfile(db_path):
             raise FileNotFoundError("DB file not found")
         if not start_local_str:
             raise ValueError("Start timestamp required.")
-        start_local = parse_local(start_local_str, tz_str)
-        end_local = parse_local(end_local_str, tz_str) if end_local_str else None
+        start_local, end_local = local_range(start_local_str, end_local_str, tz_str, textbox)
         _, start_plain, start_tz, start_epoch = to_utc_forms(start_local)
         end_plain = end_tz = None; end_epoch = None
         if end_local:
             _, end_plain, end_tz, end_epoch = to_utc_forms(end_local)
 
-        conn = ensure_connection(db_path)
-        try:
-            mid = get_metadata_id(conn, entity_id)
+        session = get_session(db_path)
+        with session.reading() as conn:
+            mid = session.metadata_id(entity_id)
             if mid is None:
                 log(f"Entity not found in statistics_meta: {entity_id}", textbox)
-                sims = list_similar_ids(conn, entity_id)
+                sims = session.similar_ids(entity_id)
                 if sims:
                     log("Similar statistic_ids:", textbox)
                     for sid, name in sims:
                         log(f"  metadata_id={sid}  statistic_id={name}", textbox)
                 return
 
-            use_start_ts = table_has_column(conn, "statistics", "start_ts")
+            use_start_ts, sep = session.time_layout("statistics")
+            col_sql, col_list = build_column_select(which_cols)
+            result = {
+                "entity_id": entity_id, "metadata_id": mid, "columns": col_list,
+                "start_utc": start_epoch if use_start_ts else start_plain,
+                "end_utc": (end_epoch if use_start_ts else end_plain) if end_local else None,
+                "tables": {},
+            }
             log(f"Entity metadata_id: {mid}", textbox)
             log(f"Local START: {start_local_str} {tz_str}", textbox)
             if end_local:
@@ -145,15 +1454,13 @@ def preview_changes(db_path, entity_id, start_local_str, end_local_str, tz_str,
             overall = cur.fetchone()[0]
             log(f"Total rows in `statistics` for this entity: {overall}", textbox)
 
-            where_sql, params_fn = range_where_clause(use_start_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch)
+            where_sql, params_fn = range_where_clause(use_start_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch, sep)
             cur.execute(f"SELECT COUNT(*) FROM statistics WHERE {where_sql};", params_fn(mid))
             count_main = cur.fetchone()[0]
             log(f"Rows in `statistics` within range: {count_main}", textbox)
 
-            # Select columns per choice
-            col_sql, col_list = build_column_select(which_cols)
             sel_col = "start_ts" if use_start_ts else "start"
-            order_col = "start_ts" if use_start_ts else "datetime(start)"
+            order_col = sel_col
             cur.execute(f"""
                 SELECT {sel_col}, {col_sql} FROM statistics
                 WHERE {where_sql}
@@ -161,104 +1468,623 @@ def preview_changes(db_path, entity_id, start_local_str, end_local_str, tz_str,
                 LIMIT 10;
             """, params_fn(mid))
             rows = cur.fetchall()
+            first_rows = row_records(rows, col_list, tz_str, use_start_ts)
+            result["tables"]["statistics"] = {"rows_total": overall, "rows_in_range": count_main, "first_rows": first_rows}
             if rows:
                 header = " | ".join(["time"] + col_list)
                 log("First rows inside range (" + header + "):", textbox)
-                for row in rows:
-                    time_val = row[0]
-                    vals = row[1:]
-                    if use_start_ts:
-                        iso = datetime.fromtimestamp(int(time_val), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00:00")
-                        log("  " + " | ".join([iso] + [str(v) for v in vals]), textbox)
-                    else:
-                        log("  " + " | ".join([str(time_val)] + [str(v) for v in vals]), textbox)
+                for record in first_rows:
+                    log("  " + " | ".join(str(v) for v in record.values()), textbox)
             else:
                 log("No rows inside the selected range.", textbox)
 
             if include_short_term:
-                use_st_ts = table_has_column(conn, "statistics_short_term", "start_ts")
+                use_st_ts, sep_st = session.time_layout("statistics_short_term")
                 cur.execute("SELECT COUNT(*) FROM statistics_short_term WHERE metadata_id = ?;", (mid,))
                 overall_st = cur.fetchone()[0]
                 log(f"Total rows in `statistics_short_term` for this entity: {overall_st}", textbox)
 
-                where_sql_st, params_fn_st = range_where_clause(use_st_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch)
+                where_sql_st, params_fn_st = range_where_clause(use_st_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch, sep_st)
                 cur.execute(f"SELECT COUNT(*) FROM statistics_short_term WHERE {where_sql_st};", params_fn_st(mid))
                 count_st = cur.fetchone()[0]
                 log(f"Rows in `statistics_short_term` within range: {count_st}", textbox)
-
-        finally:
-            conn.close()
+                result["tables"]["statistics_short_term"] = {"rows_total": overall_st, "rows_in_range": count_st}
+            return result
 
     except Exception as e:
         log(f"ERROR during preview: {e}", textbox)
+        return None
 
-def apply_correction(db_path, entity_id, start_local_str, end_local_str, tz_str, offset, textbox, which_cols, include_short_term=False):
+def dry_run_diff(db_path, entity_id, start_local_str, end_local_str, tz_str, offset, textbox, which_cols):
+    # What the energy dashboard would show after the offset, computed in SQL without
+    # touching the table: consumption = LAG delta of the column, before vs after
+    # (column + offset inside [start, end)), aggregated per local hour/day/month.
     try:
         if not os.path.isfile(db_path):
             raise FileNotFoundError("DB file not found")
         if not start_local_str:
             raise ValueError("Start timestamp required.")
-        start_local = parse_local(start_local_str, tz_str)
-        end_local = parse_local(end_local_str, tz_str) if end_local_str else None
+        start_local, end_local = local_range(start_local_str, end_local_str, tz_str, textbox)
+        _, start_plain, _, start_epoch = to_utc_forms(start_local)
+        end_plain = end_epoch = None
+        if end_local:
+            _, end_plain, _, end_epoch = to_utc_forms(end_local)
+        _, cols = build_column_select(which_cols)
+
+        session = get_session(db_path)
+        with session.reading() as conn:
+            mid = session.metadata_id(entity_id)
+            if mid is None:
+                log(f"Entity not found in statistics_meta: {entity_id}", textbox)
+                for sid, name in session.similar_ids(entity_id):
+                    log(f"  similar: metadata_id={sid}  statistic_id={name}", textbox)
+                return None
+            use_ts, sep = session.time_layout("statistics")
+            first = start_local.replace(day=1, hour=0, minute=0)
+            _, lo_plain, _, lo_epoch = to_utc_forms(first)
+            hi_plain = hi_epoch = None
+            if end_local:
+                # through the end of END's month: the row at END (where the offset stops) is inside
+                last = end_local.replace(day=1, hour=0, minute=0)
+                last = last.replace(year=last.year + last.month // 12, month=last.month % 12 + 1)
+                _, hi_plain, _, hi_epoch = to_utc_forms(last)
+            if use_ts:
+                tcol, epoch_sql = "start_ts", "start_ts"
+                lo, hi, r_lo, r_hi = lo_epoch, hi_epoch, start_epoch, end_epoch
+            else:
+                tcol = "start"
+                epoch_sql = "CAST(strftime('%s', substr(start, 1, 10) || ' ' || substr(start, 12, 8)) AS INTEGER)"
+                lo, hi = legacy_bound(lo_plain, sep), legacy_bound(hi_plain, sep)
+                r_lo, r_hi = legacy_bound(start_plain, sep), legacy_bound(end_plain, sep)
+            # local buckets: UTC offset per row from the zone's transition table (DST switches inside the window)
+            offset_sql = local_clock(tz_str).offset_sql(epoch_sql, lo_epoch, hi_epoch or int(time.time()) + 86400)
+            fix_sql = f"({tcol} >= ?" + (f" AND {tcol} < ?)" if r_hi is not None else ")")
+            fix_p = (r_lo,) + ((r_hi,) if r_hi is not None else ())
+            hi_sql = f" AND {tcol} < ?" if hi is not None else ""
+            hi_p = (hi,) if hi is not None else ()
+            # the row before the window gives the first row its delta; the first row at or after END
+            # its END edge; only rows inside the window (win = 1) are bucketed
+            select_sql = f"SELECT {tcol} AS t, {epoch_sql} AS ut, {epoch_sql} + {offset_sql} AS lt, {fix_sql} AS fix, {', '.join(cols)}"
+            around_sql = f"""
+                UNION
+                SELECT * FROM ({select_sql}, 0 AS win FROM statistics WHERE metadata_id = ? AND {tcol} < ? ORDER BY {tcol} DESC LIMIT 1)
+            """
+            around_p = (*fix_p, mid, lo)
+            if r_hi is not None:
+                around_sql += f"""
+                UNION
+                SELECT * FROM ({select_sql}, {tcol} < ? AS win FROM statistics WHERE metadata_id = ? AND {tcol} >= ? ORDER BY {tcol} LIMIT 1)
+                """
+                around_p += (*fix_p, hi if hi is not None else r_hi, mid, r_hi)
+            delta_sql = ",\n".join(
+                f"{c} - LAG({c}) OVER w AS b_{c}, ({c} + fix * ?) - (LAG({c}) OVER w + LAG(fix) OVER w * ?) AS a_{c}" for c in cols)
+            diff_cte = f"""
+                WITH s AS (
+                    {select_sql}, 1 AS win FROM statistics WHERE metadata_id = ? AND {tcol} >= ?{hi_sql}
+                    {around_sql}
+                ),
+                d AS (
+                    SELECT t, ut, lt, win, fix, fix - LAG(fix) OVER w AS edge, {delta_sql}
+                    FROM s WINDOW w AS (ORDER BY t)
+                )
+            """
+            cte_p = (*fix_p, mid, lo, *hi_p, *around_p) + (offset, offset) * len(cols)
+            sums = ", ".join(f"SUM(b_{c}), SUM(a_{c})" for c in cols)
+            changed = " OR ".join(f"abs(COALESCE(SUM(a_{c}) - SUM(b_{c}), 0)) > {DIFF_EPSILON}" for c in cols)
+            cur = conn.cursor()
+
+            rng = f"{start_local_str} → {end_local_str or '∞'} ({tz_str})"
+            log(f"=== Dry run: {entity_id} offset {offset:+g} on {', '.join(cols)}, range {rng} ===", textbox)
+            log(f"Consumption (Δ{'/Δ'.join(cols)}) before → after, local periods in {tz_str}, "
+                f"from {first:%Y-%m-%d}. Nothing is written.", textbox)
+
+            cur.execute(diff_cte + "SELECT ut, edge, " + ", ".join(f"b_{c}, a_{c}" for c in cols)
+                        + " FROM d WHERE edge != 0 ORDER BY t;", cte_p)
+            edges = cur.fetchall()
+            if not edges:
+                log("No rows inside the selected range.", textbox)
+            for when, (ut, edge, *vals) in zip(local_times([e[0] for e in edges], tz_str), edges):
+                where = "START" if edge > 0 else "END"
+                pairs = "  ".join(f"Δ{c} {fmt_num(vals[2 * i])} → {fmt_num(vals[2 * i + 1])}" for i, c in enumerate(cols))
+                log(f"  {where} boundary at {when}: {pairs}", textbox)
+
+            for name, fmt in DIFF_PERIODS:
+                having = f" HAVING {changed}" if name != "monthly" else ""
+                cur.execute(diff_cte + f"""
+                    SELECT strftime(?, lt, 'unixepoch') AS period, COUNT(*), {sums}
+                    FROM d WHERE win AND b_{cols[0]} IS NOT NULL GROUP BY period{having} ORDER BY period;
+                """, cte_p + (fmt,))
+                rows = cur.fetchall()
+                log(f"{name.capitalize()} ({'changed periods only' if having else 'all periods'}): "
+                    + " | ".join(f"{c} before → after" for c in cols), textbox)
+                for period, n, *vals in rows:
+                    pairs = " | ".join(f"{fmt_num(vals[2 * i])} → {fmt_num(vals[2 * i + 1])}" for i in range(len(cols)))
+                    log(f"  {period}  {pairs}  ({n} rows)", textbox)
+                if not rows:
+                    log("  (no change)", textbox)
+            return edges
+    except Exception as e:
+        log(f"ERROR during dry run: {e}", textbox)
+        return None
+
+def fmt_num(value):
+    return "NULL" if value is None else f"{value:,.3f}"
+
+def apply_correction(db_path, entity_id, start_local_str, end_local_str, tz_str, offset, textbox, which_cols, include_short_term=False, backup_compression=None,
+                     chunked=False, chunk_rows=APPLY_CHUNK_ROWS):
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if not start_local_str:
+            raise ValueError("Start timestamp required.")
+        start_local, end_local = local_range(start_local_str, end_local_str, tz_str, textbox)
         _, start_plain, start_tz, start_epoch = to_utc_forms(start_local)
         end_plain = end_tz = None; end_epoch = None
         if end_local:
             _, end_plain, end_tz, end_epoch = to_utc_forms(end_local)
 
-        backup = make_backup(db_path, textbox)
-        if not backup:
-            if not messagebox.askyesno("Proceed without backup?", "Backup could not be created. Proceed anyway?"):
-                log("Aborted by user.", textbox)
-                return
+        if backup_compression is not None and working_copy(db_path) is None:
+            backup = make_backup(db_path, textbox, backup_compression)
+            if not backup:
+                check_cancelled()
+                if not ask_yes_no("Proceed without backup?", "Backup could not be created. Proceed anyway?"):
+                    log("Aborted by user.", textbox)
+                    return
+
+        session = get_session(db_path)
+        mid = session.metadata_id(entity_id)
+        if mid is None:
+            log(f"Entity not found in statistics_meta: {entity_id}", textbox)
+            sims = session.similar_ids(entity_id)
+            if sims:
+                log("Similar statistic_ids:", textbox)
+                for sid, name in sims:
+                    log(f"  metadata_id={sid}  statistic_id={name}", textbox)
+            return
+        cols = (["sum"] if which_cols=="sum" else ["state"] if which_cols=="state" else ["sum","state"])
+        rng = f"{start_local_str} → {end_local_str or '∞'} ({tz_str})"
+        if chunked:
+            params = {
+                "entity_id": entity_id, "metadata_id": mid, "range": rng, "offset": offset, "columns": cols,
+                "tables": ["statistics"] + (["statistics_short_term"] if include_short_term else []),
+                "start_plain": start_plain, "start_epoch": start_epoch, "end_plain": end_plain, "end_epoch": end_epoch,
+                "chunk_rows": int(chunk_rows),
+            }
+            return apply_chunked(db_path, params, textbox)
+        use_start_ts, sep = session.time_layout("statistics")
+        use_st_ts, sep_st = session.time_layout("statistics_short_term") if include_short_term else (True, " ")
 
         conn = ensure_connection(db_path)
         try:
-            mid = get_metadata_id(conn, entity_id)
-            if mid is None:
-                log(f"Entity not found in statistics_meta: {entity_id}", textbox)
-                sims = list_similar_ids(conn, entity_id)
-                if sims:
-                    log("Similar statistic_ids:", textbox)
-                    for sid, name in sims:
-                        log(f"  metadata_id={sid}  statistic_id={name}", textbox)
-                return
-
-            use_start_ts = table_has_column(conn, "statistics", "start_ts")
+            attach_journal(conn, db_path)
+            replay_pending(conn, db_path, textbox)
             cur = conn.cursor()
             conn.execute("BEGIN;")
 
-            where_sql, params_fn = range_where_clause(use_start_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch)
-
-            cols = (["sum"] if which_cols=="sum" else ["state"] if which_cols=="state" else ["sum","state"])
-            updated_main = {}
-            for col in cols:
-                cur.execute(f"UPDATE statistics SET {col} = {col} + ? WHERE {where_sql};", (offset, *params_fn(mid)))
-                updated_main[col] = cur.rowcount
+            where_sql, params_fn = range_where_clause(use_start_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch, sep)
 
-            updated_st = 0
+            journal_id = journal_start(cur, "offset", f"{entity_id} {rng} offset {offset:+g}", cols)
+            updated = {"statistics": journal_rows(cur, journal_id, "statistics", where_sql, params_fn(mid), cols, offset)}
             if include_short_term:
-                use_st_ts = table_has_column(conn, "statistics_short_term", "start_ts")
-                where_sql_st, params_fn_st = range_where_clause(use_st_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch)
-                for col in cols:
-                    cur.execute(f"UPDATE statistics_short_term SET {col} = {col} + ? WHERE {where_sql_st};", (offset, *params_fn_st(mid)))
-                    updated_st += cur.rowcount
-
+                where_sql_st, params_fn_st = range_where_clause(use_st_ts, start_plain, start_tz, start_epoch, end_plain, end_tz, end_epoch, sep_st)
+                updated["statistics_short_term"] = journal_rows(cur, journal_id, "statistics_short_term", where_sql_st, params_fn_st(mid), cols, offset)
             conn.commit()
-            rng = f"{start_local_str} → {end_local_str or '∞'} ({tz_str})"
+            written = journal_apply(conn, db_path, journal_id)
+
             log(f"Applied offset {offset:+g} to {', '.join(cols)} for range {rng}.", textbox)
-            log("Updated rows (statistics): " + (", ".join([f"{k}={v}" for k, v in updated_main.items()]) if updated_main else "0"), textbox)
+            log(f"Updated rows (statistics): {written.get('statistics', 0)}", textbox)
             if include_short_term:
-                log(f"Updated rows (statistics_short_term): {updated_st}", textbox)
+                log(f"Updated rows (statistics_short_term): {written.get('statistics_short_term', 0)}", textbox)
+            log(f"Undo entry #{journal_id} written to the {journal_name(db_path)}", textbox)
             log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+            return updated
 
         except Exception as e:
             conn.rollback()
             log(f"ERROR during apply (rolled back): {e}", textbox)
+            return None
         finally:
             conn.close()
 
     except Exception as e:
         log(f"ERROR during apply: {e}", textbox)
+        return None
+
+def pending_chunked_apply(cur):
+    # latest chunked apply that neither finished nor was undone: (correction_id, params, tbl, next_start)
+    cur.execute("""
+        SELECT k.correction_id, k.params, k.tbl, k.next_start FROM journal.checkpoints k
+        JOIN journal.corrections c ON c.id = k.correction_id
+        WHERE k.finished IS NULL AND c.undone IS NULL
+        ORDER BY k.correction_id DESC LIMIT 1;
+    """)
+    row = cur.fetchone()
+    return (row[0], json.loads(row[1]), row[2], row[3]) if row else None
+
+def apply_chunked(db_path, params, textbox, resume=None):
+    # offset over [start, end) in chunks of at most chunk_rows rows per table. A transaction spanning
+    # the HA DB and the attached journal is not atomic in WAL mode, so each chunk commits twice: the
+    # old values go to the journal first, then the rows are set to journaled value + offset together
+    # with the checkpoint. Redoing a chunk whose rows landed but whose checkpoint did not gives the
+    # same values again, so an interrupted run can always be resumed from the checkpoint.
+    session = get_session(db_path)
+    conn = ensure_connection(db_path)
+    try:
+        attach_journal(conn, db_path)
+        cur = conn.cursor()
+        if resume is None:
+            replay_pending(conn, db_path, textbox)
+            pending = pending_chunked_apply(cur)
+            if pending:
+                log(f"Chunked apply #{pending[0]} ({pending[1]['entity_id']} {pending[1]['range']}) is unfinished: "
+                    "resume it or undo it first.", textbox)
+                return None
+            conn.execute("BEGIN;")
+            journal_id = journal_start(cur, "offset", f"{params['entity_id']} {params['range']} offset {params['offset']:+g} (chunked)",
+                                       params["columns"])
+            first_table, cursor = params["tables"][0], None
+            cur.execute("INSERT INTO journal.checkpoints (correction_id, params, tbl, next_start) VALUES (?, ?, ?, NULL);",
+                        (journal_id, json.dumps(params), first_table))
+        else:
+            journal_id, first_table, cursor = resume
+            log(f"Resuming chunked apply #{journal_id} at {first_table}" + (f" from {cursor}" if cursor is not None else ""), textbox)
+
+        mid, offset, cols, tables = params["metadata_id"], params["offset"], params["columns"], params["tables"]
+        set_sql = ", ".join(f"{c} = j.new_{c}" for c in cols)
+        bounds, total = {}, 0
+        for table in tables[tables.index(first_table):]:
+            use_ts, sep = session.time_layout(table)
+            time_col = "start_ts" if use_ts else "start"
+            lower = params["start_epoch"] if use_ts else legacy_bound(params["start_plain"], sep)
+            upper = params["end_epoch"] if use_ts else legacy_bound(params["end_plain"], sep)
+            if table == first_table and cursor is not None:
+                lower = cursor
+            bounds[table] = (time_col, lower, upper)
+            invalidate_scan_cache(db_path, table, {mid: lower})
+            upper_sql = f" AND {time_col} < ?" if upper is not None else ""
+            cur.execute(f"SELECT COUNT(*) FROM {table} WHERE metadata_id = ? AND {time_col} >= ?{upper_sql};",
+                        (mid, lower) + ((upper,) if upper is not None else ()))
+            total += cur.fetchone()[0]
+
+        done, chunks, updated = 0, 0, {}
+        for table, (time_col, lower, upper) in bounds.items():
+            upper_sql = f" AND {time_col} < ?" if upper is not None else ""
+            upper_p = (upper,) if upper is not None else ()
+            following = tables[tables.index(table) + 1:]
+            while True:
+                check_cancelled()
+                if not conn.in_transaction:
+                    conn.execute("BEGIN;")
+                cur.execute(f"SELECT {time_col} FROM {table} WHERE metadata_id = ? AND {time_col} >= ?{upper_sql} "
+                            f"ORDER BY {time_col} LIMIT 1 OFFSET ?;", (mid, lower, *upper_p, params["chunk_rows"]))
+                row = cur.fetchone()
+                boundary = row[0] if row else None
+                if boundary is not None:
+                    where_sql, where_p = f"metadata_id = ? AND {time_col} >= ? AND {time_col} < ?", (mid, lower, boundary)
+                else:
+                    where_sql, where_p = f"metadata_id = ? AND {time_col} >= ?{upper_sql}", (mid, lower, *upper_p)
+                journal_rows(cur, journal_id, table, where_sql, where_p, cols, offset)
+                conn.commit()
+                conn.execute("BEGIN;")
+                cur.execute(f"UPDATE {table} SET {set_sql} FROM journal.rows AS j "
+                            f"WHERE j.correction_id = ? AND j.tbl = ? AND j.row_id = {table}.id AND {where_sql};",
+                            (journal_id, table, *where_p))
+                updated[table] = updated.get(table, 0) + cur.rowcount
+                done += cur.rowcount
+                if boundary is not None:
+                    state = (table, boundary, None)
+                elif following:
+                    state = (following[0], None, None)
+                else:
+                    state = (table, None, datetime.now().isoformat(timespec="seconds"))
+                cur.execute("UPDATE journal.checkpoints SET tbl = ?, next_start = ?, finished = ? WHERE correction_id = ?;",
+                            (*state, journal_id))
+                if state[2] is not None:
+                    cur.execute("UPDATE journal.corrections SET applied = ? WHERE id = ?;", (state[2], journal_id))
+                conn.commit()
+                conn.execute("PRAGMA main.wal_checkpoint(TRUNCATE);").fetchall()
+                chunks += 1
+                report_progress(done, total)
+                if boundary is None:
+                    break
+                lower = boundary
+        log(f"Applied offset {offset:+g} to {', '.join(cols)} for range {params['range']} in {chunks} chunks.", textbox)
+        for table, n in updated.items():
+            log(f"Updated rows ({table}): {n}", textbox)
+        log(f"Undo entry #{journal_id} written to the {journal_name(db_path)}", textbox)
+        log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+        return updated
+    except Exception as e:
+        conn.rollback()
+        log(f"ERROR during chunked apply (current chunk rolled back, use Resume apply to continue): {e}", textbox)
+        return None
+    finally:
+        conn.close()
+
+def resume_chunked_apply(db_path, textbox):
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if not journal_exists(db_path):
+            log("No undo journal found for this DB.", textbox)
+            return None
+        conn = ensure_connection(db_path)
+        try:
+            attach_journal(conn, db_path)
+            pending = pending_chunked_apply(conn.cursor())
+        finally:
+            conn.close()
+        if pending is None:
+            log("No unfinished chunked apply to resume.", textbox)
+            return None
+        journal_id, params, table, cursor = pending
+        return apply_chunked(db_path, params, textbox, resume=(journal_id, table, cursor))
+    except Exception as e:
+        log(f"ERROR during resume: {e}", textbox)
+        return None
+
+BATCH_FIELDS = ("entity_id", "start", "end", "offset", "columns")
+
+def load_corrections(path, default_cols="sum"):
+    # CSV with header entity_id,start,end,offset[,columns] or a JSON list of objects with the same keys
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            items = json.load(f)
+        if isinstance(items, dict):
+            items = items.get("corrections", [])
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            items = list(csv.DictReader(f))
+    corrections = []
+    for n, item in enumerate(items, 1):
+        entity_id = str(item.get("entity_id") or "").strip()
+        start = str(item.get("start") or "").strip()
+        offset = str(item.get("offset") if item.get("offset") is not None else "").strip()
+        if not (entity_id and start and offset):
+            raise ValueError(f"Correction #{n}: entity_id, start and offset are required.")
+        cols = str(item.get("columns") or default_cols).strip()
+        if cols not in ("sum", "state", "both"):
+            raise ValueError(f"Correction #{n}: columns must be sum, state or both (got {cols!r}).")
+        corrections.append({
+            "entity_id": entity_id,
+            "start": start,
+            "end": str(item.get("end") or "").strip(),
+            "offset": float(offset.replace(",", ".")),
+            "columns": cols,
+        })
+    return corrections
+
+def apply_batch_corrections(db_path, corrections, tz_str, textbox, include_short_term=False, backup_compression=None):
+    # all corrections in one transaction: temp range table + one set-based UPDATE ... FROM per table
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if not corrections:
+            raise ValueError("No corrections to apply.")
+        if sqlite3.sqlite_version_info < (3, 33, 0):
+            raise RuntimeError(f"SQLite >= 3.33 required for batch corrections (have {sqlite3.sqlite_version}).")
+
+        ranges = []
+        for n, c in enumerate(corrections, 1):
+            start_local, end_local = local_range(c["start"], c["end"], tz_str, textbox, label=f"#{n} ")
+            _, start_plain, _, start_epoch = to_utc_forms(start_local)
+            end_plain = None; end_epoch = None
+            if end_local:
+                _, end_plain, _, end_epoch = to_utc_forms(end_local)
+            d_sum = c["offset"] if c["columns"] in ("sum", "both") else 0.0
+            d_state = c["offset"] if c["columns"] in ("state", "both") else 0.0
+            ranges.append((c["entity_id"], start_epoch, end_epoch, start_plain, end_plain, d_sum, d_state))
+        # only the columns some correction asks for are written (and restored by undo)
+        cols = [col for col in ("sum", "state") if any(c["columns"] in (col, "both") for c in corrections)]
+
+        session = get_session(db_path)
+        mids = session.metadata()
+        missing = sorted({r[0] for r in ranges if r[0] not in mids})
+        if missing:
+            log("Batch aborted, entities not found in statistics_meta: " + ", ".join(missing), textbox)
+            for entity_id in missing:
+                for sid, name in session.similar_ids(entity_id):
+                    log(f"  similar: metadata_id={sid}  statistic_id={name}", textbox)
+            return None
+        tables = ["statistics"] + (["statistics_short_term"] if include_short_term else [])
+        layouts = {table: session.time_layout(table) for table in tables}
+
+        if backup_compression is not None and working_copy(db_path) is None:
+            backup = make_backup(db_path, textbox, backup_compression)
+            if not backup:
+                check_cancelled()
+                if not ask_yes_no("Proceed without backup?", "Backup could not be created. Proceed anyway?"):
+                    log("Aborted by user.", textbox)
+                    return None
+
+        conn = ensure_connection(db_path)
+        try:
+            attach_journal(conn, db_path)
+            replay_pending(conn, db_path, textbox)
+            cur = conn.cursor()
+            conn.execute("BEGIN;")
+            cur.execute("""
+                CREATE TEMP TABLE fix_ranges (
+                    n INTEGER PRIMARY KEY, metadata_id INTEGER NOT NULL,
+                    start_ts REAL NOT NULL, end_ts REAL, start_plain TEXT NOT NULL, end_plain TEXT,
+                    d_sum REAL NOT NULL, d_state REAL NOT NULL
+                );
+            """)
+            cur.executemany(
+                "INSERT INTO fix_ranges (metadata_id, start_ts, end_ts, start_plain, end_plain, d_sum, d_state) VALUES (?, ?, ?, ?, ?, ?, ?);",
+                [(mids[r[0]],) + r[1:] for r in ranges],
+            )
+
+            entities = sorted({c["entity_id"] for c in corrections})
+            journal_id = journal_start(cur, "batch", f"batch of {len(corrections)} corrections: " + ", ".join(entities), cols)
+            counts = {}
+            for table in tables:
+                use_ts, sep = layouts[table]
+                join_sql = range_join_clause(use_ts, "s", "r", sep)
+                # overlapping ranges of one entity add up, like separate applies would
+                cur.execute(f"""
+                    INSERT OR IGNORE INTO journal.rows (correction_id, tbl, row_id, sum, state, new_sum, new_state)
+                    SELECT ?, '{table}', s.id, s.sum, s.state, s.sum + SUM(r.d_sum), s.state + SUM(r.d_state)
+                    FROM fix_ranges r JOIN {table} s ON {join_sql}
+                    GROUP BY s.id;
+                """, (journal_id,))
+                cur.execute(f"SELECT r.n, COUNT(s.id) FROM fix_ranges r LEFT JOIN {table} s ON {join_sql} GROUP BY r.n ORDER BY r.n;")
+                counts[table] = dict(cur.fetchall())
+            cur.execute("DROP TABLE fix_ranges;")
+            conn.commit()
+            written = journal_apply(conn, db_path, journal_id)
+
+            log(f"=== Batch applied: {len(corrections)} corrections ({tz_str}) ===", textbox)
+            for n, c in enumerate(corrections, 1):
+                per_table = ", ".join(f"{t}={counts[t].get(n, 0)}" for t in tables)
+                log(f"  #{n} {c['entity_id']} {c['start']} → {c['end'] or '∞'} offset {c['offset']:+g} ({c['columns']}): {per_table}", textbox)
+            for table in tables:
+                log(f"Updated rows ({table}): {written.get(table, 0)}", textbox)
+            log(f"Undo entry #{journal_id} written to the {journal_name(db_path)}", textbox)
+            log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+            if include_short_term:
+                check_short_term(db_path, textbox, metadata_ids=sorted({mids[r[0]] for r in ranges}), tz_str=tz_str)
+            return {t: written.get(t, 0) for t in tables}
+
+        except Exception as e:
+            conn.rollback()
+            log(f"ERROR during batch apply (rolled back): {e}", textbox)
+            return None
+        finally:
+            conn.close()
+
+    except Exception as e:
+        log(f"ERROR during batch apply: {e}", textbox)
+        return None
+
+def undo_correction(db_path, textbox, correction_id=None, on_disk=False):
+    # restores the journaled old values of one correction (default: latest not yet undone).
+    # on_disk: from the disk journal while a working copy is open (e.g. a Commit to disk);
+    # rows of the copy without pending changes follow the restored disk values
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if not journal_exists(db_path, on_disk):
+            log("No undo journal found for this DB.", textbox)
+            return None
+
+        wc = working_copy(db_path) if on_disk else None
+        name = journal_name(db_path, on_disk)
+        conn = ensure_connection(db_path, on_disk=on_disk)
+        try:
+            if wc is not None:
+                conn.execute("ATTACH DATABASE ? AS wc;", (wc.uri,))
+            attach_journal(conn, db_path, on_disk)
+            replay_pending(conn, db_path, textbox, on_disk)
+            cur = conn.cursor()
+            if correction_id is None:
+                cur.execute("SELECT MAX(id) FROM journal.corrections WHERE undone IS NULL;")
+                correction_id = cur.fetchone()[0]
+                if correction_id is None:
+                    log(f"Nothing to undo in the {name}.", textbox)
+                    return None
+            cur.execute("SELECT description, columns, undone FROM journal.corrections WHERE id = ?;", (correction_id,))
+            row = cur.fetchone()
+            if row is None:
+                log(f"Entry #{correction_id} not found in the {name}.", textbox)
+                return None
+            description, columns, undone = row
+            if undone:
+                log(f"Correction #{correction_id} was already undone at {undone}.", textbox)
+                return None
+
+            # restoring old values would also revert later corrections of the same rows
+            cur.execute("""
+                SELECT DISTINCT later.correction_id FROM journal.rows mine
+                JOIN journal.rows later ON later.tbl = mine.tbl AND later.row_id = mine.row_id AND later.correction_id > mine.correction_id
+                JOIN journal.corrections c ON c.id = later.correction_id AND c.undone IS NULL
+                WHERE mine.correction_id = ?
+                ORDER BY later.correction_id;
+            """, (correction_id,))
+            blocking = [r[0] for r in cur.fetchall()]
+            if blocking:
+                log(f"Cannot undo #{correction_id}: later corrections touch the same rows, undo them first: "
+                    + ", ".join(f"#{b}" for b in blocking), textbox)
+                return None
+
+            cols = [c for c in columns.split(",") if c in VALUE_COLUMNS]
+            set_sql = ", ".join(f"{c} = j.{c}" for c in cols)
+            conn.execute("BEGIN;")
+            restored, synced, kept = {}, 0, 0
+            cur.execute("SELECT DISTINCT tbl FROM journal.rows WHERE correction_id = ?;", (correction_id,))
+            for (table,) in cur.fetchall():
+                if table not in STAT_TABLES:
+                    raise ValueError(f"Unexpected table in journal: {table}")
+                cur.execute(f"""
+                    UPDATE main.{table} AS t SET {set_sql}
+                    FROM journal.rows j
+                    WHERE j.correction_id = ? AND j.tbl = ? AND t.id = j.row_id;
+                """, (correction_id, table))
+                restored[table] = cur.rowcount
+                if wc is not None:
+                    # pending rows keep their changes unless they already match the restored values
+                    cur.execute(f"""
+                        SELECT j.row_id, c.row_id IS NOT NULL AND EXISTS (
+                            SELECT 1 FROM wc.{table} m JOIN main.{table} d ON d.id = m.id
+                            WHERE m.id = j.row_id AND ({" OR ".join(f"m.{c} IS NOT d.{c}" for c in VALUE_COLUMNS)}))
+                        FROM journal.rows j
+                        LEFT JOIN wc._wc_changed c ON c.tbl = j.tbl AND c.row_id = j.row_id
+                        WHERE j.correction_id = ? AND j.tbl = ?;
+                    """, (correction_id, table))
+                    rows = cur.fetchall()
+                    synced += reload_from_disk(cur, table, [r[0] for r in rows if not r[1]])
+                    kept += sum(r[1] for r in rows)
+            invalidate_journaled(db_path, cur, correction_id, on_disk)
+            conn.commit()
+            # marked only once the old values are back; undoing again after a crash in between
+            # writes the same values
+            cur.execute("UPDATE journal.corrections SET undone = ? WHERE id = ?;",
+                        (datetime.now().isoformat(timespec="seconds"), correction_id))
+            conn.commit()
+            log(f"Undone correction #{correction_id} of the {name}: {description}", textbox)
+            log("Restored rows: " + (", ".join(f"{t}={n}" for t, n in restored.items()) or "none"), textbox)
+            if wc is not None:
+                wc.signature = file_signature(db_path)
+                log(f"Working copy: {synced} rows follow the disk, {kept} rows with pending changes keep them "
+                    "(Commit to disk skips those, \"Keep disk rows\" drops their changes).", textbox)
+            log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+            return correction_id
+
+        except Exception as e:
+            conn.rollback()
+            log(f"ERROR during undo (rolled back): {e}", textbox)
+            return None
+        finally:
+            conn.close()
+
+    except Exception as e:
+        log(f"ERROR during undo: {e}", textbox)
+        return None
+
+def list_journal(db_path, textbox, limit=20, on_disk=False):
+    try:
+        if not journal_exists(db_path, on_disk):
+            log("No undo journal found for this DB.", textbox)
+            return []
+        conn = sqlite3.connect(journal_path(db_path, on_disk), uri=True, factory=TracedConnection)
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT c.id, c.created, c.description, c.undone,
+                       (SELECT COUNT(*) FROM rows r WHERE r.correction_id = c.id)
+                FROM corrections c ORDER BY c.id DESC LIMIT ?;
+            """, (limit,))
+            entries = cur.fetchall()
+        finally:
+            conn.close()
+        log(f"=== Undo journal: {journal_name(db_path, on_disk)} ===", textbox)
+        for cid, created, description, undone, n_rows in entries:
+            state = f"undone {undone}" if undone else "active"
+            log(f"  #{cid} | {created} | {n_rows} rows | {state} | {description}", textbox)
+        return entries
+    except Exception as e:
+        log(f"ERROR reading undo journal: {e}", textbox)
+        return []
 
 def diagnose(db_path, entity_id, start_local_str, end_local_str, tz_str, textbox, which_cols):
     try:
@@ -266,20 +2092,19 @@ def diagnose(db_path, entity_id, start_local_str, end_local_str, tz_str, textbox
             raise FileNotFoundError("DB file not found")
         if not start_local_str:
             raise ValueError("Start timestamp required.")
-        start_local = parse_local(start_local_str, tz_str)
-        end_local = parse_local(end_local_str, tz_str) if end_local_str else None
+        start_local, end_local = local_range(start_local_str, end_local_str, tz_str, textbox)
         _, start_plain, start_tz, start_epoch = to_utc_forms(start_local)
         end_plain = end_tz = None; end_epoch = None
         if end_local:
             _, end_plain, end_tz, end_epoch = to_utc_forms(end_local)
 
-        conn = ensure_connection(db_path)
-        try:
-            mid = get_metadata_id(conn, entity_id)
+        session = get_session(db_path)
+        with session.reading() as conn:
+            mid = session.metadata_id(entity_id)
             log("=== Diagnose ===", textbox)
             if mid is None:
                 log(f"Entity not found in statistics_meta: {entity_id}", textbox)
-                sims = list_similar_ids(conn, entity_id)
+                sims = session.similar_ids(entity_id)
                 if sims:
                     log("Similar statistic_ids:", textbox)
                     for sid, name in sims:
@@ -287,126 +2112,971 @@ def diagnose(db_path, entity_id, start_local_str, end_local_str, tz_str, textbox
                 return
 
             cur = conn.cursor()
-            use_start_ts = table_has_column(conn, "statistics", "start_ts")
+            use_start_ts, sep = session.time_layout("statistics")
             log(f"Entity metadata_id: {mid}", textbox)
             log(f"Columns selected: {which_cols}", textbox)
 
             # Global range + last 5 (according to selection)
             col_sql, col_list = build_column_select(which_cols)
+            time_col = "start_ts" if use_start_ts else "start"
+            result = {"entity_id": entity_id, "metadata_id": mid, "columns": col_list}
+
+            def show(key, rows):
+                result[key] = row_records(rows, col_list, tz_str, use_start_ts)
+                for record in result[key]:
+                    log("  " + " | ".join(str(v) for v in record.values()), textbox)
+
+            cur.execute(f"SELECT MIN({time_col}), MAX({time_col}), COUNT(*) FROM statistics WHERE metadata_id = ?;", (mid,))
+            mn, mx, cnt = cur.fetchone()
+            mn, mx = local_times([mn, mx], tz_str, use_start_ts) if cnt else (None, None)
+            result.update({"min": mn, "max": mx, "rows_total": cnt})
             if use_start_ts:
-                cur.execute("SELECT MIN(start_ts), MAX(start_ts), COUNT(*) FROM statistics WHERE metadata_id = ?;", (mid,))
-                mn, mx, cnt = cur.fetchone()
-                mn_iso = datetime.fromtimestamp(int(mn), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00:00") if mn else None
-                mx_iso = datetime.fromtimestamp(int(mx), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00:00") if mx else None
-                log(f"Range in `statistics` (start_ts): min={mn_iso}, max={mx_iso}, total_rows={cnt}", textbox)
-                head = " | ".join(["time"] + col_list)
-                log("Last 5 rows overall (" + head + "):", textbox)
-                cur.execute(f"SELECT start_ts, {col_sql} FROM statistics WHERE metadata_id = ? ORDER BY start_ts DESC LIMIT 5;", (mid,))
-                for row in cur.fetchall():
-                    iso = datetime.fromtimestamp(int(row[0]), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00:00")
-                    vals = row[1:]
-                    log("  " + " | ".join([iso] + [str(v) for v in vals]), textbox)
+                log(f"Range in `statistics` (start_ts): min={mn}, max={mx}, total_rows={cnt}", textbox)
             else:
-                cur.execute("SELECT MIN(start), MAX(start), COUNT(*) FROM statistics WHERE metadata_id = ?;", (mid,))
-                mn, mx, cnt = cur.fetchone()
                 log(f"Range in `statistics`: min={mn}, max={mx}, total_rows={cnt}", textbox)
-                head = " | ".join(["time"] + col_list)
-                log("Last 5 rows overall (" + head + "):", textbox)
-                cur.execute(f"SELECT start, {col_sql} FROM statistics WHERE metadata_id = ? ORDER BY datetime(start) DESC LIMIT 5;", (mid,))
-                for row in cur.fetchall():
-                    log("  " + " | ".join([str(row[0])] + [str(v) for v in row[1:]]), textbox)
+            head = " | ".join(["time"] + col_list)
+            log("Last 5 rows overall (" + head + "):", textbox)
+            cur.execute(f"SELECT {time_col}, {col_sql} FROM statistics WHERE metadata_id = ? ORDER BY {time_col} DESC LIMIT 5;", (mid,))
+            show("last_rows", cur.fetchall())
 
             # Boundary listings
+            log(f"Local START: {start_local_str} {tz_str}", textbox)
+            if end_local:
+                log(f"Local END (exclusive): {end_local_str} {tz_str}", textbox)
             if use_start_ts:
-                to_iso = lambda ts: datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00:00")
-                log(f"Local START: {start_local_str} {tz_str}", textbox)
-                if end_local:
-                    log(f"Local END (exclusive): {end_local_str} {tz_str}", textbox)
                 log(f"UTC START epoch: {start_epoch}" + (f", END epoch: {end_epoch}" if end_epoch else ""), textbox)
+                start_cmp, end_cmp = start_epoch, end_epoch
+            else:
+                log(f"UTC START: {start_plain}" + (f", END: {end_plain}" if end_plain else ""), textbox)
+                start_cmp, end_cmp = legacy_bound(start_plain, sep), legacy_bound(end_plain, sep)
 
-                log("Rows just BEFORE start:", textbox)
-                cur.execute(f"""
-                    SELECT start_ts, {col_sql} FROM statistics
-                    WHERE metadata_id = ? AND start_ts < ?
-                    ORDER BY start_ts DESC LIMIT 5;
-                """, (mid, start_epoch))
-                for row in cur.fetchall():
-                    log("  " + " | ".join([to_iso(row[0])] + [str(v) for v in row[1:]]), textbox)
-
-                log("Rows IN RANGE:", textbox)
-                if end_local:
-                    cur.execute(f"""
-                        SELECT start_ts, {col_sql} FROM statistics
-                        WHERE metadata_id = ? AND start_ts >= ? AND start_ts < ?
-                        ORDER BY start_ts ASC LIMIT 12;
-                    """, (mid, start_epoch, end_epoch))
-                else:
-                    cur.execute(f"""
-                        SELECT start_ts, {col_sql} FROM statistics
-                        WHERE metadata_id = ? AND start_ts >= ?
-                        ORDER BY start_ts ASC LIMIT 12;
-                    """, (mid, start_epoch))
-                for row in cur.fetchall():
-                    log("  " + " | ".join([to_iso(row[0])] + [str(v) for v in row[1:]]), textbox)
-
-                if end_local:
-                    log("Rows just AFTER end:", textbox)
-                    cur.execute(f"""
-                        SELECT start_ts, {col_sql} FROM statistics
-                        WHERE metadata_id = ? AND start_ts >= ?
-                        ORDER BY start_ts ASC LIMIT 5;
-                    """, (mid, end_epoch))
-                    for row in cur.fetchall():
-                        log("  " + " | ".join([to_iso(row[0])] + [str(v) for v in row[1:]]), textbox)
+            log("Rows just BEFORE start:", textbox)
+            cur.execute(f"""
+                SELECT {time_col}, {col_sql} FROM statistics
+                WHERE metadata_id = ? AND {time_col} < ?
+                ORDER BY {time_col} DESC LIMIT 5;
+            """, (mid, start_cmp))
+            show("before_start", cur.fetchall())
 
+            log("Rows IN RANGE:", textbox)
+            if end_local:
+                cur.execute(f"""
+                    SELECT {time_col}, {col_sql} FROM statistics
+                    WHERE metadata_id = ? AND {time_col} >= ? AND {time_col} < ?
+                    ORDER BY {time_col} ASC LIMIT 12;
+                """, (mid, start_cmp, end_cmp))
             else:
-                log(f"Local START: {start_local_str} {tz_str}", textbox)
-                if end_local:
-                    log(f"Local END (exclusive): {end_local_str} {tz_str}", textbox)
-                log(f"UTC START: {start_plain}" + (f", END: {end_plain}" if end_plain else ""), textbox)
+                cur.execute(f"""
+                    SELECT {time_col}, {col_sql} FROM statistics
+                    WHERE metadata_id = ? AND {time_col} >= ?
+                    ORDER BY {time_col} ASC LIMIT 12;
+                """, (mid, start_cmp))
+            show("in_range", cur.fetchall())
 
-                log("Rows just BEFORE start:", textbox)
+            if end_local:
+                log("Rows just AFTER end:", textbox)
                 cur.execute(f"""
-                    SELECT start, {col_sql} FROM statistics
-                    WHERE metadata_id = ? AND datetime(start) < datetime(?)
-                    ORDER BY datetime(start) DESC LIMIT 5;
-                """, (mid, start_plain))
-                for row in cur.fetchall():
-                    log("  " + " | ".join([str(row[0])] + [str(v) for v in row[1:]]), textbox)
-
-                log("Rows IN RANGE:", textbox)
-                if end_local:
-                    cur.execute(f"""
-                        SELECT start, {col_sql} FROM statistics
-                        WHERE metadata_id = ? AND datetime(start) >= datetime(?) AND datetime(start) < datetime(?)
-                        ORDER BY datetime(start) ASC LIMIT 12;
-                    """, (mid, start_plain, end_plain))
+                    SELECT {time_col}, {col_sql} FROM statistics
+                    WHERE metadata_id = ? AND {time_col} >= ?
+                    ORDER BY {time_col} ASC LIMIT 5;
+                """, (mid, end_cmp))
+                show("after_end", cur.fetchall())
+            return result
+
+    except Exception as e:
+        log(f"ERROR during diagnose: {e}", textbox)
+        return None
+
+def epoch_to_iso(ts):
+    return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00:00")
+
+def step_stats(deltas):
+    # typical step (median) and typical step size (median |step|)
+    if np is not None:
+        return float(np.median(deltas)), float(np.median(np.abs(deltas)))
+    return pystats.median(deltas), pystats.median([abs(d) for d in deltas])
+
+def step_limits(deltas, factor=SCAN_FACTOR, min_delta=SCAN_MIN_DELTA):
+    # typical step (median) and how far a step may deviate from it before it is a jump
+    typical, scale = step_stats(deltas)
+    return typical, max(min_delta, factor * scale)
+
+def valid_deltas(values):
+    if np is not None:
+        deltas = np.diff(np.asarray(values, dtype=float))  # None -> nan
+        return deltas, deltas[~np.isnan(deltas)]
+    deltas = [None if a is None or b is None else b - a for a, b in zip(values, values[1:])]
+    return deltas, [d for d in deltas if d is not None]
+
+def find_jumps(values, factor=SCAN_FACTOR, min_delta=SCAN_MIN_DELTA, stats=None):
+    # returns [(row_index_after_step, delta, typical_delta)] for suspicious steps;
+    # stats = (typical, scale) judges the steps against known history instead of the series itself
+    if len(values) < (2 if stats else 3):
+        return []
+    deltas, valid = valid_deltas(values)
+    if not len(valid):
+        return []
+    typical, scale = stats or step_stats(valid)
+    limit = max(min_delta, factor * scale)
+    if np is not None:
+        hits = np.nonzero(~np.isnan(deltas) & (np.abs(deltas - typical) > limit))[0]
+        return [(int(i) + 1, float(deltas[i]), typical) for i in hits]
+    return [(i + 1, d, typical) for i, d in enumerate(deltas) if d is not None and abs(d - typical) > limit]
+
+def step_sketch(deltas, sketch=None):
+    # merges steps into {"z": zero steps, "p"/"n": {bucket: count}} of rising/falling steps;
+    # bucket k holds sizes in (SKETCH_GAMMA^(k-1), SKETCH_GAMMA^k]
+    sketch = sketch or {"z": 0, "p": {}, "n": {}}
+    log_gamma = math.log(SKETCH_GAMMA)
+    if np is not None:
+        d = np.asarray(deltas, dtype=float)
+        zero = np.abs(d) <= SKETCH_ZERO
+        sketch["z"] += int(zero.sum())
+        for side, sizes in (("p", d[~zero & (d > 0)]), ("n", -d[~zero & (d < 0)])):
+            keys, counts = np.unique(np.ceil(np.log(sizes) / log_gamma).astype(int), return_counts=True)
+            for k, c in zip(keys.tolist(), counts.tolist()):
+                sketch[side][k] = sketch[side].get(k, 0) + c
+        return sketch
+    for d in deltas:
+        if abs(d) <= SKETCH_ZERO:
+            sketch["z"] += 1
+            continue
+        buckets = sketch["p" if d > 0 else "n"]
+        k = math.ceil(math.log(abs(d)) / log_gamma)
+        buckets[k] = buckets.get(k, 0) + 1
+    return sketch
+
+def sketch_median(buckets):
+    # buckets: [(value, count)] in ascending order; the middle (or mean of both middle) values
+    total = sum(c for _, c in buckets)
+    wanted, found, seen = sorted({(total - 1) // 2, total // 2}), [], 0
+    for value, count in buckets:
+        seen += count
+        while wanted and wanted[0] < seen:
+            wanted.pop(0)
+            found.append(value)
+    return sum(found) / len(found)
+
+def sketch_stats(sketch):
+    # (typical, scale) like step_stats, from a step_sketch histogram
+    value = lambda k: 2 * SKETCH_GAMMA ** k / (SKETCH_GAMMA + 1)
+    sizes = dict(sketch["p"])
+    for k, c in sketch["n"].items():
+        sizes[k] = sizes.get(k, 0) + c
+    signed = ([(-value(k), c) for k, c in sorted(sketch["n"].items(), reverse=True)] + [(0.0, sketch["z"])]
+              + [(value(k), c) for k, c in sorted(sketch["p"].items())])
+    return sketch_median(signed), sketch_median([(0.0, sketch["z"])] + [(value(k), c) for k, c in sorted(sizes.items())])
+
+def load_sketch(text):
+    sketch = json.loads(text)
+    return {"z": sketch["z"], "p": {int(k): c for k, c in sketch["p"].items()}, "n": {int(k): c for k, c in sketch["n"].items()}}
+
+def scan_cache_path(db_path):
+    return f"{db_path}.scan.sqlite"
+
+def open_scan_cache(db_path):
+    # side-car cache of scan_jumps: per table/metadata_id/column the last scanned row and step statistics,
+    # plus the suspicious steps found so far
+    conn = sqlite3.connect(scan_cache_path(db_path), factory=TracedConnection)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS scan_state (
+            tbl TEXT NOT NULL,
+            metadata_id INTEGER NOT NULL,
+            col TEXT NOT NULL,
+            last_time NOT NULL,
+            last_id INTEGER NOT NULL,
+            last_value REAL,
+            n INTEGER NOT NULL,
+            typical REAL,
+            scale REAL,
+            sketch TEXT,
+            PRIMARY KEY (tbl, metadata_id, col)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS scan_hits (
+            tbl TEXT NOT NULL,
+            metadata_id INTEGER NOT NULL,
+            col TEXT NOT NULL,
+            time NOT NULL,
+            before REAL,
+            after REAL,
+            delta REAL NOT NULL,
+            typical REAL NOT NULL,
+            PRIMARY KEY (tbl, metadata_id, col, time)
+        ) WITHOUT ROWID;
+    """)
+    # caches written before the step histogram: their series are scanned again once
+    if "sketch" not in {r[1] for r in conn.execute("PRAGMA table_info(scan_state);")}:
+        conn.execute("ALTER TABLE scan_state ADD COLUMN sketch TEXT;")
+    return conn
+
+def invalidate_scan_cache(db_path, table, since=None, on_disk=False):
+    # Drop cached scan state of entity series whose rows change. since: {metadata_id: first changed
+    # start_ts/start}, None = the whole table. Series cached only up to before that point stay valid,
+    # the next scan reads the changed rows as new ones. Writes to a working copy never touch the cache.
+    if (working_copy(db_path) is not None and not on_disk) or not os.path.isfile(scan_cache_path(db_path)):
+        return
+    conn = open_scan_cache(db_path)
+    try:
+        if since is None:
+            conn.execute("DELETE FROM scan_hits WHERE tbl = ?;", (table,))
+            conn.execute("DELETE FROM scan_state WHERE tbl = ?;", (table,))
+        else:
+            keys = [(table, mid, t) for mid, t in since.items()]
+            conn.executemany("""
+                DELETE FROM scan_hits WHERE tbl = ? AND metadata_id = ? AND col IN
+                    (SELECT col FROM scan_state s WHERE s.tbl = scan_hits.tbl AND s.metadata_id = scan_hits.metadata_id
+                     AND s.last_time >= ?);
+            """, keys)
+            conn.executemany("DELETE FROM scan_state WHERE tbl = ? AND metadata_id = ? AND last_time >= ?;", keys)
+        conn.commit()
+    finally:
+        conn.close()
+
+def invalidate_journaled(db_path, cur, journal_id, on_disk=False):
+    # invalidates the scan cache for the rows journaled under journal_id (call before commit)
+    if (working_copy(db_path) is not None and not on_disk) or not os.path.isfile(scan_cache_path(db_path)):
+        return
+    session = get_session(db_path)
+    cur.execute("SELECT DISTINCT tbl FROM journal.rows WHERE correction_id = ?;", (journal_id,))
+    for (table,) in cur.fetchall():
+        time_col = "start_ts" if session.time_layout(table)[0] else "start"
+        cur.execute(f"""
+            SELECT s.metadata_id, MIN(s.{time_col}) FROM journal.rows j JOIN main.{table} s ON s.id = j.row_id
+            WHERE j.correction_id = ? AND j.tbl = ? GROUP BY s.metadata_id;
+        """, (journal_id, table))
+        invalidate_scan_cache(db_path, table, dict(cur.fetchall()), on_disk)
+
+def scan_jumps(db_path, textbox, which_cols="sum", include_short_term=False, top_n=SCAN_TOP_N, use_cache=True, tz_str=DEFAULT_TZ):
+    # one pass over every statistic_id; returns all hits ranked by size of the step.
+    # With the scan cache only rows after the last scanned one are read; their steps
+    # are judged against the median step of the history, kept as a step histogram.
+    results = []
+    cache = None
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if use_cache and working_copy(db_path) is None:
+            cache = open_scan_cache(db_path)
+
+        session = get_session(db_path)
+        with session.reading() as conn:
+            cur = conn.cursor()
+            metas = [(mid, statistic_id) for statistic_id, mid in session.metadata().items()]
+            cols = (["sum"] if which_cols=="sum" else ["state"] if which_cols=="state" else ["sum","state"])
+            tables = ["statistics"] + (["statistics_short_term"] if include_short_term else [])
+            log("=== Scan for jumps ===", textbox)
+            log(f"Entities: {len(metas)}, tables: {', '.join(tables)}, columns: {', '.join(cols)}", textbox)
+
+            total_rows = cached_entities = 0
+            for table in tables:
+                use_ts, _ = session.time_layout(table)
+                time_col = "start_ts" if use_ts else "start"
+                sql = f"SELECT id, {time_col}, {', '.join(cols)} FROM {table} WHERE metadata_id = ?"
+                states, found_hits = {}, []
+                if cache is not None:
+                    for row in cache.execute(f"""
+                        SELECT metadata_id, col, last_time, last_id, last_value, n, typical, scale, sketch FROM scan_state
+                        WHERE tbl = ? AND col IN ({', '.join('?' * len(cols))});
+                    """, (table, *cols)):
+                        states.setdefault(row[0], {})[row[1]] = row[2:]
+                for n, (mid, statistic_id) in enumerate(metas):
+                    check_cancelled()
+                    report_progress(tables.index(table) * len(metas) + n, len(tables) * len(metas))
+                    state = states.get(mid, {})
+                    if (len(state) == len(cols) and len({s[:2] for s in state.values()}) == 1
+                            and all(s[6] is not None for s in state.values())):
+                        last_time, last_id = next(iter(state.values()))[:2]
+                        # the cached last row must be unchanged, or the history is scanned again
+                        cur.execute(f"SELECT {time_col}, {', '.join(cols)} FROM {table} WHERE id = ?;", (last_id,))
+                        row = cur.fetchone()
+                        if row is None or row[0] != last_time or any(row[i + 1] != state[c][2] for i, c in enumerate(cols)):
+                            state = {}
+                    else:
+                        state = {}
+                    if state:
+                        cur.execute(sql + f" AND {time_col} > ? ORDER BY {time_col} ASC;", (mid, last_time))
+                        cached_entities += 1
+                    else:
+                        cur.execute(sql + f" ORDER BY {time_col} ASC;", (mid,))
+                    ids, times = [], []
+                    series = [[] for _ in cols]
+                    while True:
+                        batch = cur.fetchmany(SCAN_BATCH_ROWS)
+                        if not batch:
+                            break
+                        columns = list(zip(*batch))
+                        ids.extend(columns[0])
+                        times.extend(columns[1])
+                        for i in range(len(cols)):
+                            series[i].extend(columns[i + 2])
+                    total_rows += len(times)
+                    if not times:
+                        continue
+                    updates, hits = [], []
+                    for col, values in zip(cols, series):
+                        if state:
+                            # prepend the last cached value: index 0 is history, steps start at the first new row
+                            _, _, last_value, count, typical, scale, sketch = state[col]
+                            values = [last_value] + values
+                            row_times = [last_time] + times
+                            found = find_jumps(values, stats=(typical, scale)) if count else find_jumps(values)
+                            _, new_valid = valid_deltas(values)
+                            sketch = load_sketch(sketch)
+                            if len(new_valid):
+                                step_sketch(new_valid, sketch)
+                                count += len(new_valid)
+                                typical, scale = sketch_stats(sketch)
+                        else:
+                            row_times = times
+                            found = find_jumps(values)
+                            _, valid = valid_deltas(values)
+                            count = len(valid)
+                            typical, scale = step_stats(valid) if count else (None, None)
+                            sketch = step_sketch(valid)
+                        updates.append((table, mid, col, times[-1], ids[-1], values[-1], count, typical, scale, json.dumps(sketch)))
+                        for idx, delta, typical_delta in found:
+                            hits.append((table, mid, col, row_times[idx], values[idx - 1], values[idx], delta, typical_delta))
+                    if cache is not None:
+                        if not state:
+                            cache.execute("DELETE FROM scan_hits WHERE tbl = ? AND metadata_id = ?;", (table, mid))
+                        cache.executemany("INSERT OR REPLACE INTO scan_state VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", updates)
+                        cache.executemany("INSERT OR REPLACE INTO scan_hits VALUES (?, ?, ?, ?, ?, ?, ?, ?);", hits)
+                    else:
+                        found_hits.extend((h, statistic_id) for h in hits)
+                if cache is not None:
+                    cache.commit()
+                    names = dict(metas)
+                    for row in cache.execute(f"SELECT * FROM scan_hits WHERE tbl = ? AND col IN ({', '.join('?' * len(cols))});",
+                                             (table, *cols)):
+                        if row[1] in names:
+                            found_hits.append((row, names[row[1]]))
+                starts = local_times([h[3] for h, _ in found_hits], tz_str, use_ts)
+                results.extend(scan_result(h, statistic_id, use_ts, start) for (h, statistic_id), start in zip(found_hits, starts))
+
+        results.sort(key=lambda r: abs(r["delta"] - r["typical"]), reverse=True)
+        if cache is not None:
+            log(f"Scan cache {scan_cache_path(db_path)}: {cached_entities} entity series continued from the cache.", textbox)
+        log(f"Scanned {total_rows} rows, suspicious steps: {len(results)}", textbox)
+        if results:
+            log(f"Top {min(top_n, len(results))} (rank | statistic_id | table | column | time | delta | suggested offset):", textbox)
+            for rank, r in enumerate(results[:top_n], 1):
+                log(f"  #{rank} | {r['statistic_id']} | {r['table']} | {r['column']} | {r['start']} | "
+                    f"{r['delta']:+.3f} (typical {r['typical']:+.3f}) | {r['suggested_offset']:+.3f}", textbox)
+            log(f"The time ({tz_str}) is the first row after the step: use it as START to apply the suggested offset.", textbox)
+        return results
+
+    except Exception as e:
+        log(f"ERROR during scan: {e}", textbox)
+        return results
+    finally:
+        if cache is not None:
+            cache.commit()  # keep the entities scanned before a cancel
+            cache.close()
+
+def scan_result(hit, statistic_id, use_ts, start):
+    table, mid, col, t, before, after, delta, typical = hit
+    return {
+        "metadata_id": mid,
+        "statistic_id": statistic_id,
+        "table": table,
+        "column": col,
+        "start": start,
+        "start_utc": epoch_to_iso(t) if use_ts else str(t),
+        "start_ts": t if use_ts else None,
+        "before": before,
+        "after": after,
+        "delta": delta,
+        "typical": typical,
+        "suggested_offset": -(delta - typical),
+    }
+
+def check_short_term(db_path, textbox, entity_id=None, metadata_ids=None, tolerance=CONSISTENCY_TOLERANCE, top_n=CONSISTENCY_LIST_N,
+                     tz_str=DEFAULT_TZ):
+    # The hourly row of hour H carries the sum/state of the last 5-minute row in [H, H+1h).
+    # One grouped query per check: short-term rows grouped per metadata_id and hour
+    # (last row via MAX() bare columns), joined to the hourly row; complete hours only.
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        session = get_session(db_path)
+        with session.reading() as conn:
+            if entity_id:
+                mid = session.metadata_id(entity_id)
+                if mid is None:
+                    log(f"Entity not found in statistics_meta: {entity_id}", textbox)
+                    return None
+                metadata_ids = [mid]
+            use_ts, sep = session.time_layout("statistics")
+            use_st_ts, sep_st = session.time_layout("statistics_short_term")
+            if use_ts != use_st_ts:
+                raise RuntimeError("statistics and statistics_short_term use different time columns.")
+            only = lambda ids: f"WHERE metadata_id IN ({', '.join('?' * len(ids))})" if ids else ""
+            if use_ts:
+                hour_sql, last_sql, hour_label = "CAST(start_ts AS INTEGER) / 3600 * 3600", "MAX(start_ts)", "st.hour"
+                join_sql, complete_sql = "h.start_ts = st.hour", "st.last >= st.hour + 3300"
+            else:
+                # short-term hour key in the hourly table's date/time separator, compared as text
+                hour_sql = "substr(start, 1, 13)" if sep_st == sep else f"replace(substr(start, 1, 13), '{sep_st}', '{sep}')"
+                last_sql, hour_label = "MAX(start)", "st.hour || ':00'"
+                join_sql = f"h.start >= st.hour || ':00:00' AND h.start < st.hour || ':00:01'"
+                complete_sql = "substr(st.last, 15, 2) = '55'"
+            cte = lambda filt: f"""
+                WITH st AS (
+                    SELECT metadata_id, {hour_sql} AS hour, {last_sql} AS last, sum, state
+                    FROM statistics_short_term {filt}
+                    GROUP BY metadata_id, hour
+                ),
+                cmp AS (
+                    SELECT st.metadata_id, {hour_label} AS hour, st.sum AS st_sum, h.sum AS h_sum, st.state AS st_state, h.state AS h_state,
+                           abs(COALESCE(st.sum - h.sum, CASE WHEN (st.sum IS NULL) = (h.sum IS NULL) THEN 0 ELSE 1e308 END)) AS d_sum,
+                           abs(COALESCE(st.state - h.state, CASE WHEN (st.state IS NULL) = (h.state IS NULL) THEN 0 ELSE 1e308 END)) AS d_state
+                    FROM st JOIN statistics h ON h.metadata_id = st.metadata_id AND {join_sql}
+                    WHERE {complete_sql}
+                )
+            """
+            cur = conn.cursor()
+            cur.execute(cte(only(metadata_ids)) + """
+                SELECT metadata_id, COUNT(*), SUM(d_sum > ? OR d_state > ?), MAX(d_sum), MAX(d_state)
+                FROM cmp GROUP BY metadata_id;
+            """, tuple(metadata_ids or ()) + (tolerance,) * 2)
+            summary = cur.fetchall()
+            checked, entities = sum(r[1] for r in summary), len(summary)
+            per_entity = sorted((r for r in summary if r[2]), key=lambda r: -max(r[3], r[4]))
+            hours = []
+            if per_entity:
+                # the hour list only revisits the divergent entities
+                bad_ids = [r[0] for r in per_entity]
+                cur.execute(cte(only(bad_ids)) + """
+                    SELECT metadata_id, hour, st_sum, h_sum, st_state, h_state, MAX(d_sum, d_state) AS d
+                    FROM cmp WHERE d_sum > ? OR d_state > ? ORDER BY d DESC LIMIT ?;
+                """, tuple(bad_ids) + (tolerance, tolerance, top_n))
+                hours = cur.fetchall()
+
+        names = {v: k for k, v in session.metadata().items()}
+        log(f"=== Short-term vs hourly: {checked} complete hours of {entities} entities checked (tolerance {tolerance:g}) ===", textbox)
+        if not per_entity:
+            log("All hours consistent.", textbox)
+            return []
+        log(f"Divergent entities: {len(per_entity)} (statistic_id | divergent hours | max |Δsum| | max |Δstate|):", textbox)
+        for mid, n, bad, d_sum, d_state in per_entity:
+            log(f"  {names.get(mid, mid)} | {bad}/{n} | {fmt_num(d_sum)} | {fmt_num(d_state)}", textbox)
+        log(f"Largest divergences (hour start, {tz_str} | short-term last sum → hourly sum | state):", textbox)
+        hour_labels = local_times([h[1] for h in hours], tz_str, use_ts)
+        result = []
+        for label, (mid, hour, st_sum, h_sum, st_state, h_state, d) in zip(hour_labels, hours):
+            log(f"  {names.get(mid, mid)} | {label} | sum {fmt_num(st_sum)} → {fmt_num(h_sum)} | "
+                f"state {fmt_num(st_state)} → {fmt_num(h_state)}", textbox)
+            result.append({"metadata_id": mid, "statistic_id": names.get(mid), "hour": hour, "hour_local": label, "short_term_sum": st_sum,
+                           "hourly_sum": h_sum, "short_term_state": st_state, "hourly_state": h_state, "difference": d})
+        return result
+    except Exception as e:
+        log(f"ERROR during short-term check: {e}", textbox)
+        return None
+
+def rebuild_sum(values, fixable, mode="typical", fix_negative=False, factor=SCAN_FACTOR, min_delta=SCAN_MIN_DELTA):
+    # values: sum series without NULLs; fixable[i] allows changing the step into row i + 1.
+    # Bad steps are replaced, then the series is re-accumulated from its first value.
+    # returns (new_values, [(row_index_after_step, old_delta, new_delta)])
+    if len(values) < 3:
+        return list(values), []
+    if np is not None:
+        arr = np.asarray(values, dtype=float)
+        deltas = np.diff(arr)
+        typical, limit = step_limits(deltas, factor, min_delta)
+        bad = np.abs(deltas - typical) > limit
+        if fix_negative:
+            bad |= deltas < 0
+        bad &= np.asarray(fixable, dtype=bool)
+        replacement = max(typical, 0.0) if mode == "typical" else 0.0
+        fixed = np.where(bad, replacement, deltas)
+        new = np.concatenate(([arr[0]], arr[0] + np.cumsum(fixed)))
+        return new.tolist(), [(int(i) + 1, float(deltas[i]), replacement) for i in np.nonzero(bad)[0]]
+    deltas = [b - a for a, b in zip(values, values[1:])]
+    typical, limit = step_limits(deltas, factor, min_delta)
+    replacement = max(typical, 0.0) if mode == "typical" else 0.0
+    fixes = [(i + 1, d, replacement) for i, d in enumerate(deltas)
+             if fixable[i] and (abs(d - typical) > limit or (fix_negative and d < 0))]
+    for i, _, new_delta in fixes:
+        deltas[i - 1] = new_delta
+    new = [values[0]]
+    for d in deltas:
+        new.append(new[-1] + d)
+    return new, fixes
+
+def to_epochs(times, use_ts):
+    # start_ts values or legacy start text -> list of epoch seconds
+    return [int(t) for t in times] if use_ts else [int(t) for t in legacy_epochs(times)]
+
+def short_term_shifts(hour_epochs, hour_shifts, st_epochs, st_sums):
+    # sum shift of every short-term row from the rebased hourly rows: the shift of the hour the
+    # row lies in; inside an hour whose shift changed (a repaired step), rows before the largest
+    # 5-minute step keep the previous hour's shift, so the step is removed where it happened
+    shifts = []
+    for t in st_epochs:
+        i = bisect.bisect_right(hour_epochs, t) - 1
+        shifts.append(hour_shifts[i] if i >= 0 else 0.0)
+    first = 0
+    while first < len(st_epochs):
+        i = bisect.bisect_right(hour_epochs, st_epochs[first]) - 1
+        last = bisect.bisect_left(st_epochs, st_epochs[first] + 3600 if i < 0 else hour_epochs[i] + 3600)
+        if i >= 0 and abs(hour_shifts[i] - (hour_shifts[i - 1] if i else 0.0)) > REBASE_EPSILON:
+            steps = [(abs(st_sums[k] - st_sums[k - 1]), k) for k in range(max(first, 1), last)]
+            jump = max(steps)[1] if steps else first
+            previous = hour_shifts[i - 1] if i else 0.0
+            for k in range(first, jump):
+                shifts[k] = previous
+        first = max(last, first + 1)
+    return shifts
+
+def rebase_sum(db_path, entity_id, start_local_str, end_local_str, tz_str, textbox, include_short_term=False,
+               mode="typical", fix_negative=False, confirm=True):
+    # recompute the cumulative sum of one entity; only steps inside [start, end) are
+    # repaired (empty START = whole history), every later row is re-accumulated.
+    # fix_negative also treats every falling step as bad (off for meters that may run backwards).
+    # The write re-checks each old sum and the row count and aborts if HA changed anything meanwhile.
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if mode not in REBASE_MODES:
+            raise ValueError(f"Unknown rebase mode: {mode}")
+        start_local, end_local = local_range(start_local_str, end_local_str, tz_str, textbox)
+        start_plain = start_epoch = end_plain = end_epoch = None
+        if start_local:
+            _, start_plain, _, start_epoch = to_utc_forms(start_local)
+        if end_local:
+            _, end_plain, _, end_epoch = to_utc_forms(end_local)
+
+        session = get_session(db_path)
+        mid = session.metadata_id(entity_id)
+        if mid is None:
+            log(f"Entity not found in statistics_meta: {entity_id}", textbox)
+            for sid, name in session.similar_ids(entity_id):
+                log(f"  similar: metadata_id={sid}  statistic_id={name}", textbox)
+            return None
+        tables = ["statistics"] + (["statistics_short_term"] if include_short_term else [])
+        rng = f"{start_local_str or '−∞'} → {end_local_str or '∞'} ({tz_str})"
+        log(f"=== Rebase sum: {entity_id} (metadata_id {mid}), steps in {rng}, bad steps → {mode} ===", textbox)
+
+        plans, counts = {}, {}
+        with session.reading() as conn:
+            cur = conn.cursor()
+            for table in tables:
+                check_cancelled()
+                use_ts, sep = session.time_layout(table)
+                time_col = "start_ts" if use_ts else "start"
+                cur.execute(f"SELECT id, {time_col}, sum FROM {table} WHERE metadata_id = ? AND sum IS NOT NULL ORDER BY {time_col} ASC;", (mid,))
+                rows = cur.fetchall()
+                if table == "statistics_short_term":
+                    # short-term rows only cover a recent window: they take the shift of the hourly
+                    # rebase at their time instead of being rebased on their own
+                    if "statistics" not in counts or not rows:
+                        continue
+                    counts[table] = len(rows)
+                    ids, times, sums = zip(*rows)
+                    shifts = short_term_shifts(hour_epochs, hour_shifts, to_epochs(times, use_ts), sums)
+                    changed = [(old + d, row_id, old) for d, old, row_id in zip(shifts, sums, ids) if abs(d) > REBASE_EPSILON]
+                    log(f"{table}: {len(rows)} rows, {len(changed)} rows change with the hourly sum", textbox)
+                    if changed:
+                        plans[table] = changed
+                    continue
+                if len(rows) < 3:
+                    log(f"{table}: not enough rows ({len(rows)}).", textbox)
+                    continue
+                counts[table] = len(rows)
+                ids, times, sums = zip(*rows)
+                lower = start_epoch if use_ts else legacy_bound(start_plain, sep)
+                upper = end_epoch if use_ts else legacy_bound(end_plain, sep)
+                if np is not None:
+                    t = np.asarray(times[1:])
+                    fixable = np.ones(len(t), dtype=bool)
+                    if lower is not None:
+                        fixable &= t >= lower
+                    if upper is not None:
+                        fixable &= t < upper
                 else:
-                    cur.execute(f"""
-                        SELECT start, {col_sql} FROM statistics
-                        WHERE metadata_id = ? AND datetime(start) >= datetime(?)
-                        ORDER BY datetime(start) ASC LIMIT 12;
-                    """, (mid, start_plain))
-                for row in cur.fetchall():
-                    log("  " + " | ".join([str(row[0])] + [str(v) for v in row[1:]]), textbox)
-
-                if end_local:
-                    log("Rows just AFTER end:", textbox)
-                    cur.execute(f"""
-                        SELECT start, {col_sql} FROM statistics
-                        WHERE metadata_id = ? AND datetime(start) >= datetime(?)
-                        ORDER BY datetime(start) ASC LIMIT 5;
-                    """, (mid, end_plain))
-                    for row in cur.fetchall():
-                        log("  " + " | ".join([str(row[0])] + [str(v) for v in row[1:]]), textbox)
+                    fixable = [(lower is None or t >= lower) and (upper is None or t < upper) for t in times[1:]]
+                new, fixes = rebuild_sum(sums, fixable, mode, fix_negative)
+                hour_epochs, hour_shifts = to_epochs(times, use_ts), [n - old for n, old in zip(new, sums)]
+                changed = [(n, row_id, old) for n, old, row_id in zip(new, sums, ids) if abs(n - old) > REBASE_EPSILON]
+                log(f"{table}: {len(rows)} rows, {len(fixes)} bad steps, {len(changed)} rows change", textbox)
+                labels = local_times([times[i] for i, _, _ in fixes[:10]], tz_str, use_ts)
+                for label, (i, old_delta, new_delta) in zip(labels, fixes[:10]):
+                    log(f"  {label} | Δsum {old_delta:+.3f} → {new_delta:+.3f}", textbox)
+                if len(fixes) > 10:
+                    log(f"  … {len(fixes) - 10} more", textbox)
+                if changed:
+                    plans[table] = changed
+
+        total = sum(len(c) for c in plans.values())
+        if not total:
+            log("Nothing to rebase.", textbox)
+            return {}
+        if confirm and not ask_yes_no("Rebase sum?", f"Rewrite sum of {total} rows for {entity_id}?"):
+            log("Aborted by user.", textbox)
+            return None
 
+        conn = ensure_connection(db_path)
+        try:
+            attach_journal(conn, db_path)
+            replay_pending(conn, db_path, textbox)
+            cur = conn.cursor()
+            conn.execute("BEGIN;")
+            journal_id = journal_start(cur, "rebase", f"{entity_id} rebase sum {rng} ({mode})", ["sum"])
+            for table, changed in plans.items():
+                check_cancelled()
+                # the sums read above are journaled as old values: journal_apply writes nothing
+                # if a row no longer holds them
+                cur.executemany(f"""
+                    INSERT OR IGNORE INTO journal.rows (correction_id, tbl, row_id, sum, state, new_sum)
+                    SELECT ?, '{table}', id, ?, state, ? FROM {table} WHERE id = ?;
+                """, [(journal_id, old, new, row_id) for new, row_id, old in changed])
+            conn.commit()
+
+            def same_rows(cur):
+                for table in plans:
+                    cur.execute(f"SELECT COUNT(*) FROM {table} WHERE metadata_id = ? AND sum IS NOT NULL;", (mid,))
+                    if cur.fetchone()[0] != counts[table]:
+                        raise RuntimeError(f"{table} gained or lost rows since they were read, nothing written; run Rebase sum again")
+
+            journal_apply(conn, db_path, journal_id, check=same_rows)
+            for table, changed in plans.items():
+                log(f"Rewrote sum of {len(changed)} rows in {table}.", textbox)
+            log(f"Undo entry #{journal_id} written to the {journal_name(db_path)}", textbox)
+            log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+            return {table: len(changed) for table, changed in plans.items()}
+        except Exception as e:
+            conn.rollback()
+            log(f"ERROR during rebase (rolled back): {e}", textbox)
+            return None
         finally:
             conn.close()
 
     except Exception as e:
-        log(f"ERROR during diagnose: {e}", textbox)
+        log(f"ERROR during rebase: {e}", textbox)
+        return None
+
+def find_spikes(values, times=None, fixable=None, factor=SCAN_FACTOR, min_delta=SCAN_MIN_DELTA):
+    # isolated one-row outliers: returns (row_indices, replacements); times (epochs) weight the
+    # interpolation between both neighbours, without them it is their midpoint
+    if len(values) < 3:
+        return [], []
+    if np is not None:
+        arr = np.asarray(values, dtype=float)  # None -> nan
+        deltas = np.diff(arr)
+        valid = ~np.isnan(deltas)
+        if valid.sum() < 2:
+            return [], []
+        typical, limit = step_limits(deltas[valid], factor, min_delta)
+        dev_in, dev_out = deltas[:-1] - typical, deltas[1:] - typical
+        size_in, size_out = np.abs(dev_in), np.abs(dev_out)
+        with np.errstate(invalid="ignore"):
+            spike = ((size_in > limit) & (size_out > limit) & (np.sign(dev_in) == -np.sign(dev_out))
+                     & (np.minimum(size_in, size_out) >= SPIKE_RETURN_SHARE * np.maximum(size_in, size_out)))
+        # drop both rows of an adjacent candidate pair, judged on the unfiltered candidates
+        orig = spike.copy()
+        spike[1:] &= ~orig[:-1]
+        spike[:-1] &= ~orig[1:]
+        if fixable is not None:
+            spike &= np.asarray(fixable[1:-1], dtype=bool)
+        idx = np.nonzero(spike)[0] + 1
+        if times is None:
+            weight = 0.5
+        else:
+            t = np.asarray(times, dtype=float)
+            weight = (t[idx] - t[idx - 1]) / (t[idx + 1] - t[idx - 1])
+        return idx.tolist(), (arr[idx - 1] + weight * (arr[idx + 1] - arr[idx - 1])).tolist()
+    deltas = [None if a is None or b is None else b - a for a, b in zip(values, values[1:])]
+    valid = [d for d in deltas if d is not None]
+    if len(valid) < 2:
+        return [], []
+    typical, limit = step_limits(valid, factor, min_delta)
+    spike = [False] * (len(values) - 2)
+    for i, (d_in, d_out) in enumerate(zip(deltas, deltas[1:])):
+        if d_in is None or d_out is None:
+            continue
+        dev_in, dev_out = d_in - typical, d_out - typical
+        spike[i] = (abs(dev_in) > limit and abs(dev_out) > limit and (dev_in > 0) != (dev_out > 0)
+                    and min(abs(dev_in), abs(dev_out)) >= SPIKE_RETURN_SHARE * max(abs(dev_in), abs(dev_out)))
+    idx, new = [], []
+    for i, is_spike in enumerate(spike):
+        if not is_spike or (i and spike[i - 1]) or (i + 1 < len(spike) and spike[i + 1]):
+            continue
+        if fixable is not None and not fixable[i + 1]:
+            continue
+        weight = 0.5 if times is None else (times[i + 1] - times[i]) / (times[i + 2] - times[i])
+        idx.append(i + 1)
+        new.append(values[i] + weight * (values[i + 2] - values[i]))
+    return idx, new
+
+def repair_spikes(db_path, entity_id, start_local_str, end_local_str, tz_str, textbox, include_short_term=False,
+                  columns=SPIKE_COLUMNS, confirm=True):
+    # replaces isolated outlier rows of state/mean/min/max in [START, END) (empty START = whole history)
+    # by interpolating their neighbours; all rows of a table in one UPDATE ... FROM a temp table
+    try:
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError("DB file not found")
+        if sqlite3.sqlite_version_info < (3, 33, 0):
+            raise RuntimeError(f"SQLite >= 3.33 required for spike repair (have {sqlite3.sqlite_version}).")
+        start_local, end_local = local_range(start_local_str, end_local_str, tz_str, textbox)
+        start_plain = start_epoch = end_plain = end_epoch = None
+        if start_local:
+            _, start_plain, _, start_epoch = to_utc_forms(start_local)
+        if end_local:
+            _, end_plain, _, end_epoch = to_utc_forms(end_local)
+
+        session = get_session(db_path)
+        mid = session.metadata_id(entity_id)
+        if mid is None:
+            log(f"Entity not found in statistics_meta: {entity_id}", textbox)
+            for sid, name in session.similar_ids(entity_id):
+                log(f"  similar: metadata_id={sid}  statistic_id={name}", textbox)
+            return None
+        columns = [c for c in SPIKE_COLUMNS if c in columns]
+        tables = ["statistics"] + (["statistics_short_term"] if include_short_term else [])
+        rng = f"{start_local_str or '−∞'} → {end_local_str or '∞'} ({tz_str})"
+        log(f"=== Repair spikes: {entity_id} (metadata_id {mid}), {', '.join(columns)} in {rng} ===", textbox)
+
+        plans = {}
+        with session.reading() as conn:
+            cur = conn.cursor()
+            for table in tables:
+                check_cancelled()
+                use_ts, sep = session.time_layout(table)
+                time_col = "start_ts" if use_ts else "start"
+                cur.execute(f"SELECT id, {time_col}, {', '.join(columns)} FROM {table} WHERE metadata_id = ? ORDER BY {time_col} ASC;", (mid,))
+                rows = cur.fetchall()
+                if len(rows) < 3:
+                    log(f"{table}: not enough rows ({len(rows)}).", textbox)
+                    continue
+                ids, times, *series = zip(*rows)
+                lower = start_epoch if use_ts else legacy_bound(start_plain, sep)
+                upper = end_epoch if use_ts else legacy_bound(end_plain, sep)
+                if np is not None:
+                    t = np.asarray(times)
+                    fixable = np.ones(len(t), dtype=bool)
+                    if lower is not None:
+                        fixable &= t >= lower
+                    if upper is not None:
+                        fixable &= t < upper
+                else:
+                    fixable = [(lower is None or t >= lower) and (upper is None or t < upper) for t in times]
+                fixes = {}  # row index -> {column: new value}
+                epochs = times if use_ts else legacy_epochs(times)
+                for col, values in zip(columns, series):
+                    if all(v is None for v in values):
+                        continue
+                    idx, new = find_spikes(values, epochs, fixable)
+                    log(f"{table}.{col}: {len(idx)} spikes", textbox)
+                    labels = local_times([epochs[i] for i in idx[:SPIKE_LIST_N]], tz_str)
+                    for n, (i, value) in enumerate(zip(idx, new)):
+                        fixes.setdefault(i, {})[col] = value
+                        if n < SPIKE_LIST_N:
+                            log(f"  {labels[n]} | {values[i]:.3f} → {value:.3f} (neighbours {values[i - 1]:.3f}, {values[i + 1]:.3f})", textbox)
+                    if len(idx) > SPIKE_LIST_N:
+                        log(f"  … {len(idx) - SPIKE_LIST_N} more", textbox)
+                if fixes:
+                    plans[table] = [(ids[i],) + tuple(f.get(c) for c in SPIKE_COLUMNS) for i, f in sorted(fixes.items())]
+
+        total = sum(len(p) for p in plans.values())
+        if not total:
+            log("No spikes to repair.", textbox)
+            return {}
+        if confirm and not ask_yes_no("Repair spikes?", f"Replace {', '.join(columns)} of {total} rows of {entity_id} by interpolation?"):
+            log("Aborted by user.", textbox)
+            return None
+
+        conn = ensure_connection(db_path)
+        try:
+            attach_journal(conn, db_path)
+            replay_pending(conn, db_path, textbox)
+            cur = conn.cursor()
+            conn.execute("BEGIN;")
+            journal_id = journal_start(cur, "spikes", f"{entity_id} repair spikes {rng} ({', '.join(columns)})", columns)
+            # NULL in spike_fix = column of that row stays as it is
+            cur.execute(f"CREATE TEMP TABLE spike_fix (row_id INTEGER PRIMARY KEY, {', '.join(f'{c} REAL' for c in SPIKE_COLUMNS)});")
+            new_sql = ", ".join(f"COALESCE(f.{c}, s.{c})" if c in columns else f"s.{c}" for c in VALUE_COLUMNS)
+            for table, rows in plans.items():
+                check_cancelled()
+                cur.execute("DELETE FROM spike_fix;")
+                cur.executemany(f"INSERT INTO spike_fix VALUES ({', '.join('?' * (len(SPIKE_COLUMNS) + 1))});", rows)
+                cur.execute(f"""
+                    INSERT OR IGNORE INTO journal.rows (correction_id, tbl, row_id, {', '.join(VALUE_COLUMNS)}, {', '.join(f'new_{c}' for c in VALUE_COLUMNS)})
+                    SELECT ?, '{table}', s.id, {', '.join(f's.{c}' for c in VALUE_COLUMNS)}, {new_sql} FROM spike_fix f JOIN {table} s ON s.id = f.row_id;
+                """, (journal_id,))
+            cur.execute("DROP TABLE spike_fix;")
+            conn.commit()
+            journal_apply(conn, db_path, journal_id)
+            for table, rows in plans.items():
+                log(f"Repaired {len(rows)} rows in {table}.", textbox)
+            log(f"Undo entry #{journal_id} written to the {journal_name(db_path)}", textbox)
+            log("Restart Home Assistant and hard-refresh the UI to see changes.", textbox)
+            return {table: len(rows) for table, rows in plans.items()}
+        except Exception as e:
+            conn.rollback()
+            log(f"ERROR during spike repair (rolled back): {e}", textbox)
+            return None
+        finally:
+            conn.close()
 
-def on_preview(entries, textbox, chk_short_term_var):
+    except Exception as e:
+        log(f"ERROR during spike repair: {e}", textbox)
+        return None
+
+def fetch_rows_page(conn, table, use_ts, mid, lower, inclusive, upper, limit=BROWSE_PAGE_ROWS):
+    # keyset pagination on the (metadata_id, start_ts|start) index: every page is
+    # an index range scan starting after the last key seen, no OFFSET
+    time_col = "start_ts" if use_ts else "start"
+    where = ["metadata_id = ?"]
+    params = [mid]
+    if lower is not None:
+        where.append(f"{time_col} {'>=' if inclusive else '>'} ?")
+        params.append(lower)
+    if upper is not None:
+        where.append(f"{time_col} < ?")
+        params.append(upper)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {time_col}, state, sum FROM {table}
+        WHERE {' AND '.join(where)}
+        ORDER BY {time_col} ASC LIMIT ?;
+    """, (*params, limit))
+    return cur.fetchall()
+
+def fetch_row_before(conn, table, use_ts, mid, bound):
+    # seeds the deltas of the first row in range
+    if bound is None:
+        return None
+    time_col = "start_ts" if use_ts else "start"
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {time_col}, state, sum FROM {table}
+        WHERE metadata_id = ? AND {time_col} < ?
+        ORDER BY {time_col} DESC LIMIT 1;
+    """, (mid, bound))
+    return cur.fetchone()
+
+def format_delta(cur_val, prev_val):
+    if cur_val is None or prev_val is None:
+        return ""
+    return f"{cur_val - prev_val:+.3f}"
+
+class RowBrowser:
+    # Toplevel Treeview over one entity/range; pages are loaded lazily while
+    # scrolling. Uses its own read-only session so it never waits for (or
+    # disturbs) a running background operation, and cancelling that operation
+    # does not abort its reads (they run on the UI thread).
+    COLUMNS = (("time", 200), ("state", 150), ("d_state", 110), ("sum", 150), ("d_sum", 110))
+
+    def __init__(self, root, db_path, entity_id, start_local_str, end_local_str, tz_str, table="statistics"):
+        self.session = StatsSession(db_path)
+        self.entity_id = entity_id
+        self.start_local_str = start_local_str
+        self.end_local_str = end_local_str
+        self.tz_str = tz_str
+
+        self.win = tk.Toplevel(root)
+        self.win.title(f"Rows: {entity_id}")
+        self.win.geometry("820x600")
+        self.win.protocol("WM_DELETE_WINDOW", self.close)
+
+        top = ttk.Frame(self.win, padding=(8, 8, 8, 4))
+        top.pack(fill="x")
+        ttk.Label(top, text="Table:").pack(side="left")
+        self.table = ttk.Combobox(top, values=list(STAT_TABLES), state="readonly", width=22)
+        self.table.set(table)
+        self.table.pack(side="left", padx=(4, 12))
+        self.table.bind("<<ComboboxSelected>>", lambda ev: self.reset())
+        rng = f"{start_local_str or '−∞'} → {end_local_str or '∞'} ({tz_str})"
+        ttk.Label(top, text=rng).pack(side="left")
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(top, textvariable=self.status_var, foreground="gray").pack(side="right")
+
+        body = ttk.Frame(self.win, padding=(8, 0, 8, 8))
+        body.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(body, columns=[c for c, _ in self.COLUMNS], show="headings")
+        for col, width in self.COLUMNS:
+            self.tree.heading(col, text=col.replace("d_", "Δ "))
+            self.tree.column(col, width=width, anchor="w" if col == "time" else "e", stretch=col == "time")
+        self.tree.tag_configure("negative", foreground="red")
+        self.scroll = ttk.Scrollbar(body, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scroll.pack(side="right", fill="y")
+
+        self.reset()
+
+    def reset(self):
+        self.tree.delete(*self.tree.get_children())
+        self.loaded = 0
+        self.exhausted = False
+        self.loading = False
+        self.load_pending = False  # a load_more is queued via after_idle
+        try:
+            table = self.table.get()
+            self.mid = self.session.metadata_id(self.entity_id)
+            if self.mid is None:
+                raise ValueError(f"Entity not found in statistics_meta: {self.entity_id}")
+            self.use_ts, sep = self.session.time_layout(table)
+            lower = upper = None
+            if self.start_local_str:
+                _, plain, _, epoch = to_utc_forms(parse_local(self.start_local_str, self.tz_str))
+                lower = epoch if self.use_ts else legacy_bound(plain, sep)
+            if self.end_local_str:
+                _, plain, _, epoch = to_utc_forms(parse_local(self.end_local_str, self.tz_str))
+                upper = epoch if self.use_ts else legacy_bound(plain, sep)
+            self.lower, self.upper, self.inclusive = lower, upper, True
+            before = fetch_row_before(self.session.read(), table, self.use_ts, self.mid, lower)
+            self.prev = (before[1], before[2]) if before else (None, None)
+        except Exception as e:
+            self.exhausted = True
+            self.status_var.set(f"ERROR: {e}")
+            return
+        self.load_more()
+
+    def load_more(self):
+        self.load_pending = False
+        if self.exhausted or self.loading:
+            return
+        self.loading = True
+        try:
+            rows = fetch_rows_page(self.session.read(), self.table.get(), self.use_ts, self.mid,
+                                   self.lower, self.inclusive, self.upper)
+        except Exception as e:
+            self.exhausted = True
+            self.status_var.set(f"ERROR: {e}")
+            return
+        finally:
+            self.loading = False
+        prev_state, prev_sum = self.prev
+        labels = local_times([r[0] for r in rows], self.tz_str, self.use_ts)  # one lookup per page
+        for label, (time_val, state, sum_) in zip(labels, rows):
+            d_sum = format_delta(sum_, prev_sum)
+            self.tree.insert("", tk.END, values=(
+                label,
+                "" if state is None else state, format_delta(state, prev_state),
+                "" if sum_ is None else sum_, d_sum,
+            ), tags=("negative",) if d_sum.startswith("-") else ())
+            prev_state, prev_sum = state, sum_
+        self.prev = (prev_state, prev_sum)
+        self.loaded += len(rows)
+        if rows:
+            self.lower, self.inclusive = rows[-1][0], False
+        if len(rows) < BROWSE_PAGE_ROWS:
+            self.exhausted = True
+        self.status_var.set(f"{self.loaded} rows" + ("" if self.exhausted else " (scroll for more)"))
+
+    def on_scroll(self, first, last):
+        self.scroll.set(first, last)
+        # scroll events keep coming while a page is queued: schedule it once
+        if not (self.exhausted or self.load_pending) and float(last) >= BROWSE_PREFETCH_AT:
+            self.load_pending = True
+            self.win.after_idle(self.load_more)
+
+    def close(self):
+        self.session.close()
+        self.win.destroy()
+
+def on_preview(entries, textbox, chk_short_term_var, runner):
     db_path = entries["db_path"].get().strip()
     entity_id = entries["entity_id"].get().strip()
     start_ts = entries["start_local"].get().strip()
@@ -417,9 +3087,25 @@ def on_preview(entries, textbox, chk_short_term_var):
     if not (db_path and entity_id and start_ts):
         messagebox.showerror("Missing fields", "Please fill DB path, entity_id and START timestamp.")
         return
-    preview_changes(db_path, entity_id, start_ts, end_ts, tz_str, textbox, which_cols, include_short_term=include_st)
+    runner.start("Preview", preview_changes, db_path, entity_id, start_ts, end_ts, tz_str, textbox, which_cols, include_short_term=include_st)
+
+def on_dry_run(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    entity_id = entries["entity_id"].get().strip()
+    start_ts = entries["start_local"].get().strip()
+    offset_str = entries["offset"].get().strip()
+    if not (db_path and entity_id and start_ts and offset_str):
+        messagebox.showerror("Missing fields", "Please fill DB path, entity_id, START and offset.")
+        return
+    try:
+        offset = float(offset_str.replace(",", "."))
+    except ValueError:
+        messagebox.showerror("Invalid offset", "Offset must be a number (kWh). Use negative to remove a positive jump.")
+        return
+    runner.start("Dry run", dry_run_diff, db_path, entity_id, start_ts, entries["end_local"].get().strip(),
+                 entries["tz"].get().strip() or DEFAULT_TZ, offset, textbox, entries["which_cols"].get())
 
-def on_apply(entries, textbox, chk_short_term_var):
+def on_apply(entries, textbox, chk_short_term_var, runner):
     db_path = entries["db_path"].get().strip()
     entity_id = entries["entity_id"].get().strip()
     start_ts = entries["start_local"].get().strip()
@@ -436,9 +3122,84 @@ def on_apply(entries, textbox, chk_short_term_var):
     except ValueError:
         messagebox.showerror("Invalid offset", "Offset must be a number (kWh). Use negative to remove a positive jump.")
         return
-    apply_correction(db_path, entity_id, start_ts, end_ts, tz_str, offset, textbox, which_cols, include_short_term=include_st)
+    runner.start("Apply", apply_correction, db_path, entity_id, start_ts, end_ts, tz_str, offset, textbox, which_cols,
+                 include_short_term=include_st, backup_compression=backup_choice(entries),
+                 chunked=bool(entries["chunked"].get()))
+
+def on_trace_mode(combo, textbox):
+    mode = combo.get()
+    json_path = None
+    if mode == "log + JSON":
+        json_path = filedialog.asksaveasfilename(
+            title="Write query trace (JSON lines)", defaultextension=".jsonl",
+            filetypes=[("JSON lines", "*.jsonl"), ("All files", "*.*")]
+        )
+        if not json_path:
+            combo.set("log" if QUERY_TRACE is not None else "off")
+            return
+    # statements outside a background operation (autocomplete, row browser) are summarised on switch
+    set_query_trace(mode != "off", json_path, textbox)
+    log(f"Query trace: {mode}" + (f" → {json_path}" if json_path else ""), textbox)
+
+def on_resume(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    runner.start("Resume apply", resume_chunked_apply, db_path, textbox)
+
+def on_entity_typed(entries, hint_var, event=None):
+    if event is not None and event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+        return
+    db_path = entries["db_path"].get().strip()
+    combo = entries["entity_id"]
+    if not db_path or not os.path.isfile(db_path):
+        hint_var.set("")
+        return
+    session = get_session(db_path)
+    # never wait for a running background operation just to autocomplete
+    if not session.lock.acquire(blocking=False):
+        return
+    try:
+        matches = session.entity_index().search(combo.get())
+    except Exception as e:
+        hint_var.set(f"(index unavailable: {e})")
+        return
+    finally:
+        session.lock.release()
+    combo.configure(values=[f"{sid}   [{unit or '-'} · {source or '-'}]" for _, sid, unit, source in matches])
+    typed = combo.get().strip()
+    exact = [m for m in matches if m[1] == typed]
+    if exact:
+        hint_var.set(f"metadata_id {exact[0][0]} · {exact[0][2] or '-'} · {exact[0][3] or '-'}")
+    else:
+        hint_var.set(f"{len(matches)}{'+' if len(matches) >= SUGGEST_LIMIT else ''} matches (↓ to pick)")
+
+def on_entity_picked(entries, hint_var):
+    combo = entries["entity_id"]
+    combo.set(combo.get().split()[0])
+    on_entity_typed(entries, hint_var)
+
+def backup_choice(entries):
+    # None = no full DB copy, the undo journal still records every changed row
+    mode = entries["backup_compression"].get()
+    return None if mode == "off" else mode
 
-def on_diagnose(entries, textbox):
+def on_browse(entries, chk_short_term_var):
+    db_path = entries["db_path"].get().strip()
+    entity_id = entries["entity_id"].get().strip()
+    if not (db_path and entity_id):
+        messagebox.showerror("Missing fields", "Please fill DB path and entity_id.")
+        return
+    if not os.path.isfile(db_path):
+        messagebox.showerror("DB not found", db_path)
+        return
+    table = "statistics_short_term" if chk_short_term_var.get() else "statistics"
+    RowBrowser(entries["db_path"].winfo_toplevel(), db_path, entity_id,
+               entries["start_local"].get().strip(), entries["end_local"].get().strip(),
+               entries["tz"].get().strip() or DEFAULT_TZ, table)
+
+def on_diagnose(entries, textbox, runner):
     db_path = entries["db_path"].get().strip()
     entity_id = entries["entity_id"].get().strip()
     start_ts = entries["start_local"].get().strip()
@@ -448,7 +3209,286 @@ def on_diagnose(entries, textbox):
     if not (db_path and entity_id and start_ts):
         messagebox.showerror("Missing fields", "Please fill DB path, entity_id and START timestamp.")
         return
-    diagnose(db_path, entity_id, start_ts, end_ts, tz_str, textbox, which_cols)
+    runner.start("Diagnose", diagnose, db_path, entity_id, start_ts, end_ts, tz_str, textbox, which_cols)
+
+def form_correction(entries):
+    entity_id = entries["entity_id"].get().strip()
+    start_ts = entries["start_local"].get().strip()
+    offset_str = entries["offset"].get().strip()
+    if not (entity_id and start_ts and offset_str):
+        messagebox.showerror("Missing fields", "Please fill entity_id, START and offset.")
+        return None
+    try:
+        offset = float(offset_str.replace(",", "."))
+    except ValueError:
+        messagebox.showerror("Invalid offset", "Offset must be a number (kWh). Use negative to remove a positive jump.")
+        return None
+    return {
+        "entity_id": entity_id,
+        "start": start_ts,
+        "end": entries["end_local"].get().strip(),
+        "offset": offset,
+        "columns": entries["which_cols"].get(),
+    }
+
+def on_batch_add(entries, textbox, batch):
+    c = form_correction(entries)
+    if c is None:
+        return
+    batch.append(c)
+    log(f"Batch #{len(batch)}: {c['entity_id']} {c['start']} → {c['end'] or '∞'} offset {c['offset']:+g} ({c['columns']})", textbox)
+
+def on_batch_load(entries, textbox, batch):
+    path = filedialog.askopenfilename(
+        title="Select corrections file",
+        filetypes=[("Corrections", "*.csv *.json"), ("All files", "*.*")],
+    )
+    if not path:
+        return
+    try:
+        loaded = load_corrections(path, default_cols=entries["which_cols"].get())
+    except Exception as e:
+        log(f"ERROR loading corrections: {e}", textbox)
+        return
+    batch.extend(loaded)
+    log(f"Loaded {len(loaded)} corrections from {path} (batch size now {len(batch)}).", textbox)
+
+def on_batch_apply(entries, textbox, chk_short_term_var, batch, runner):
+    db_path = entries["db_path"].get().strip()
+    tz_str = entries["tz"].get().strip() or DEFAULT_TZ
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    if not batch:
+        messagebox.showerror("Empty batch", "Add corrections with \"Add to batch\" or \"Load batch…\" first.")
+        return
+    if not messagebox.askyesno("Apply batch?", f"Apply {len(batch)} corrections in one transaction?"):
+        return
+    applied = list(batch)
+
+    def done(result):
+        if result is not None:
+            del batch[:len(applied)]
+
+    runner.start("Apply batch", apply_batch_corrections, db_path, applied, tz_str, textbox,
+                 include_short_term=bool(chk_short_term_var.get()), backup_compression=backup_choice(entries), on_done=done)
+
+def on_wc_open(entries, textbox, batch, runner, wc_var):
+    db_path = entries["db_path"].get().strip()
+    entity_id = entries["entity_id"].get().strip()
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    entity_ids = None
+    if entity_id:
+        extra = " and the batch entities" if batch else ""
+        answer = messagebox.askyesnocancel("Working copy", f"Load only {entity_id}{extra} into RAM?\n\nNo = the whole database.")
+        if answer is None:
+            return
+        if answer:
+            entity_ids = [entity_id] + [c["entity_id"] for c in batch]
+
+    def done(wc):
+        if wc is not None:
+            wc_var.set(f"Working copy: {wc.describe()}")
+
+    runner.start("Working copy", open_working_copy, db_path, textbox, entity_ids, on_done=done)
+
+def on_wc_commit(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    if working_copy(db_path) is None:
+        messagebox.showinfo("Working copy", "No working copy open for this DB.")
+        return
+    if not messagebox.askyesno("Commit to disk?", "Write the changed rows of the working copy to the DB file?\n\nClose Home Assistant first."):
+        return
+    runner.start("Commit to disk", commit_working_copy, db_path, textbox)
+
+def on_wc_keep_disk(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    if working_copy(db_path) is None:
+        messagebox.showinfo("Working copy", "No working copy open for this DB.")
+        return
+    if not messagebox.askyesno("Keep disk rows?", "Reload the pending rows that changed on disk since the working copy was loaded?\n\n"
+                               "Their changes in the working copy are dropped."):
+        return
+    runner.start("Keep disk rows", keep_disk_rows, db_path, textbox)
+
+def on_wc_discard(entries, textbox, runner, wc_var):
+    db_path = entries["db_path"].get().strip()
+    wc = working_copy(db_path)
+    if wc is None:
+        messagebox.showinfo("Working copy", "No working copy open for this DB.")
+        return
+    if runner.task is not None:
+        messagebox.showinfo("Busy", f"{runner.task.label} is still running. Cancel it or wait.")
+        return
+    if wc.pending() and not messagebox.askyesno("Discard working copy?", "Drop the working copy? Changes not committed to disk are lost."):
+        return
+    discard_working_copy(db_path, textbox)
+    wc_var.set("")
+
+def on_close(root):
+    dirty = [wc for wc in WORKING_COPIES.values() if wc.pending()]
+    if dirty and not messagebox.askyesno("Quit?", "A working copy has changes that were not committed to disk. Quit anyway?"):
+        return
+    root.destroy()
+
+def undo_on_disk(db_path):
+    # with a working copy open there are two journals: False = the copy's, True = the disk one, None = cancel
+    if working_copy(db_path) is None:
+        return False
+    answer = messagebox.askyesnocancel("Which journal?", "Undo in the working-copy journal (RAM)?\n\n"
+                                       "No = the disk journal (Commit to disk, corrections made before loading the copy).")
+    return None if answer is None else not answer
+
+def on_undo_last(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    on_disk = undo_on_disk(db_path)
+    if on_disk is None:
+        return
+    if not messagebox.askyesno("Undo?", f"Restore the rows changed by the latest correction in the {journal_name(db_path, on_disk)}?"):
+        return
+    runner.start("Undo", undo_correction, db_path, textbox, None, on_disk)
+
+def on_undo_n(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    on_disk = undo_on_disk(db_path)
+    if on_disk is None:
+        return
+    list_journal(db_path, textbox, on_disk=on_disk)
+    cid = simpledialog.askinteger("Undo correction", f"Entry # of the {journal_name(db_path, on_disk)} to undo:", minvalue=1)
+    if cid is not None:
+        runner.start("Undo", undo_correction, db_path, textbox, cid, on_disk)
+
+def on_batch_clear(textbox, batch):
+    batch.clear()
+    log("Batch cleared.", textbox)
+
+def on_rebase(entries, textbox, chk_short_term_var, runner):
+    db_path = entries["db_path"].get().strip()
+    entity_id = entries["entity_id"].get().strip()
+    if not (db_path and entity_id):
+        messagebox.showerror("Missing fields", "Please fill DB path and entity_id (START/END optional).")
+        return
+    runner.start("Rebase sum", rebase_sum, db_path, entity_id,
+                 entries["start_local"].get().strip(), entries["end_local"].get().strip(),
+                 entries["tz"].get().strip() or DEFAULT_TZ, textbox,
+                 include_short_term=bool(chk_short_term_var.get()), mode=entries["rebase_mode"].get(),
+                 fix_negative=bool(entries["rebase_negative"].get()))
+
+def on_repair_spikes(entries, textbox, chk_short_term_var, runner):
+    db_path = entries["db_path"].get().strip()
+    entity_id = entries["entity_id"].get().strip()
+    if not (db_path and entity_id):
+        messagebox.showerror("Missing fields", "Please fill DB path and entity_id (START/END optional).")
+        return
+    runner.start("Repair spikes", repair_spikes, db_path, entity_id,
+                 entries["start_local"].get().strip(), entries["end_local"].get().strip(),
+                 entries["tz"].get().strip() or DEFAULT_TZ, textbox,
+                 include_short_term=bool(chk_short_term_var.get()))
+
+def on_check_short_term(entries, textbox, runner):
+    db_path = entries["db_path"].get().strip()
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    # empty entity = every entity
+    runner.start("Check short-term", check_short_term, db_path, textbox, entries["entity_id"].get().strip() or None,
+                 tz_str=entries["tz"].get().strip() or DEFAULT_TZ)
+
+def on_scan(entries, textbox, chk_short_term_var, runner):
+    db_path = entries["db_path"].get().strip()
+    which_cols = entries["which_cols"].get()
+    include_st = bool(chk_short_term_var.get())
+    if not db_path:
+        messagebox.showerror("Missing fields", "Please fill DB path.")
+        return
+    runner.start("Scan", scan_jumps, db_path, textbox, which_cols, include_short_term=include_st,
+                 tz_str=entries["tz"].get().strip() or DEFAULT_TZ)
+
+class TaskRunner:
+    # one DB operation at a time on a worker thread; log lines, dialogs and the
+    # result are marshalled back to Tk through UI_QUEUE and after()
+    def __init__(self, root, progress, status_var, cancel_btn, textbox=None):
+        self.root = root
+        self.textbox = textbox
+        self.progress = progress
+        self.status_var = status_var
+        self.cancel_btn = cancel_btn
+        self.task = None
+        self.last_ticks = 0
+        root.after(UI_POLL_MS, self.poll)
+
+    def start(self, label, fn, *args, on_done=None, **kwargs):
+        global ACTIVE_TASK
+        if self.task is not None:
+            messagebox.showinfo("Busy", f"{self.task.label} is still running. Cancel it or wait.")
+            return
+        self.task = ACTIVE_TASK = TaskState(label)
+        self.last_ticks = 0
+
+        def run():
+            result = None
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                trace = QUERY_TRACE
+                if trace is not None and self.textbox is not None:
+                    trace.report(self.textbox, label)
+                UI_QUEUE.put(("done", on_done, result))
+
+        self.status_var.set(f"{label}…")
+        self.cancel_btn.configure(state="normal")
+        self.progress.configure(mode="indeterminate", value=0)
+        threading.Thread(target=run, name=label, daemon=True).start()
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel_event.set()
+            self.status_var.set(f"{self.task.label}: cancelling…")
+
+    def finish(self, on_done, result):
+        global ACTIVE_TASK
+        task, self.task, ACTIVE_TASK = self.task, None, None
+        self.cancel_btn.configure(state="disabled")
+        self.progress.configure(mode="determinate", value=0)
+        if task is not None:
+            state = "cancelled" if task.cancel_event.is_set() else "done"
+            self.status_var.set(f"{task.label} {state} ({time.monotonic() - task.started:.1f}s)")
+        if on_done is not None:
+            on_done(result)
+
+    def poll(self):
+        try:
+            while True:
+                item = UI_QUEUE.get_nowait()
+                if item[0] == "log":
+                    log(item[2], item[1])
+                elif item[0] == "call":
+                    _, fn, args, box, done = item
+                    try:
+                        box.append(fn(*args))
+                    finally:
+                        done.set()
+                elif item[0] == "done":
+                    self.finish(item[1], item[2])
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(UI_POLL_MS, self.poll)
+        task = self.task
+        if task is not None:
+            if task.fraction is not None:
+                self.progress.configure(mode="determinate", value=100 * task.fraction)
+            elif task.ticks != self.last_ticks:
+                self.last_ticks = task.ticks
+                self.progress.step(4)
 
 def build_gui():
     root = tk.Tk()
@@ -467,9 +3507,14 @@ def build_gui():
     entries["db_path"] = e_db
 
     ttk.Label(main, text="Entity ID (e.g., sensor.pv_sg_meter_monthly):").grid(row=2, column=0, sticky="w", pady=(10,0))
-    e_entity = ttk.Entry(main, width=60)
+    e_entity = ttk.Combobox(main, width=60)
     e_entity.grid(row=3, column=0, sticky="we", padx=(0,8))
     entries["entity_id"] = e_entity
+    entity_hint = tk.StringVar(value="")
+    ttk.Label(main, textvariable=entity_hint, foreground="gray").grid(row=3, column=1, columnspan=3, sticky="w")
+    e_entity.bind("<KeyRelease>", lambda ev: on_entity_typed(entries, entity_hint, ev))
+    e_entity.bind("<FocusIn>", lambda ev: on_entity_typed(entries, entity_hint))
+    e_entity.bind("<<ComboboxSelected>>", lambda ev: on_entity_picked(entries, entity_hint))
 
     ttk.Label(main, text="Local START (YYYY-MM-DD HH:MM):").grid(row=4, column=0, sticky="w", pady=(10,0))
     e_start = ttk.Entry(main, width=25)
@@ -483,6 +3528,23 @@ def build_gui():
     e_end.insert(0, "2025-10-01 00:00")
     entries["end_local"] = e_end
 
+    ttk.Label(main, text="Full DB backup:").grid(row=4, column=2, sticky="w", pady=(10,0))
+    compression = ttk.Combobox(main, values=BACKUP_MODES, state="readonly", width=10)
+    compression.current(0)  # default: undo journal only
+    compression.grid(row=5, column=2, sticky="w")
+    entries["backup_compression"] = compression
+
+    ttk.Label(main, text="Rebase bad steps to:").grid(row=4, column=3, sticky="w", padx=(8, 0), pady=(10,0))
+    rebase_mode = ttk.Combobox(main, values=REBASE_MODES, state="readonly", width=10)
+    rebase_mode.current(0)  # default: typical step
+    rebase_mode.grid(row=5, column=3, sticky="w", padx=(8, 0))
+    entries["rebase_mode"] = rebase_mode
+    rebase_negative = tk.IntVar(value=0)
+    ttk.Checkbutton(
+        main, text="Also rebase falling steps", variable=rebase_negative
+    ).grid(row=5, column=4, sticky="w", padx=(8, 0))
+    entries["rebase_negative"] = rebase_negative
+
     ttk.Label(main, text="Timezone (IANA):").grid(row=6, column=0, sticky="w", pady=(10,0))
     e_tz = ttk.Entry(main, width=25)
     e_tz.grid(row=7, column=0, sticky="w")
@@ -506,27 +3568,199 @@ def build_gui():
     )
     chk_short_term.grid(row=7, column=3, sticky="w", padx=(8, 0))
 
+    chk_chunked_var = tk.IntVar(value=0)
+    ttk.Checkbutton(
+        main, text="Chunked apply (resumable)", variable=chk_chunked_var
+    ).grid(row=6, column=3, sticky="w", padx=(8, 0), pady=(10,0))
+    entries["chunked"] = chk_chunked_var
+
     btns = ttk.Frame(main)
     btns.grid(row=8, column=0, columnspan=4, sticky="w", pady=(12,6))
-    ttk.Button(btns, text="Preview", command=lambda: on_preview(entries, txt, chk_short_term_var)).pack(side="left", padx=(0,8))
-    ttk.Button(btns, text="Apply Correction", command=lambda: on_apply(entries, txt, chk_short_term_var)).pack(side="left", padx=(0,8))
-    ttk.Button(btns, text="Diagnose", command=lambda: on_diagnose(entries, txt)).pack(side="left", padx=(0,8))
-
-    ttk.Label(main, text="Log (shows no local time!):").grid(row=9, column=0, sticky="w", pady=(10,0))
-    txt = tk.Text(main, height=28, width=140, state="disabled")
-    txt.grid(row=10, column=0, columnspan=4, sticky="nsew")
-    scroll = ttk.Scrollbar(main, orient="vertical", command=txt.yview)
-    scroll.grid(row=10, column=4, sticky="ns")
-    txt.configure(yscrollcommand=scroll.set)
+    ttk.Button(btns, text="Preview", command=lambda: on_preview(entries, txt, chk_short_term_var, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Dry run", command=lambda: on_dry_run(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Apply Correction", command=lambda: on_apply(entries, txt, chk_short_term_var, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Resume apply", command=lambda: on_resume(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Diagnose", command=lambda: on_diagnose(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Scan for jumps", command=lambda: on_scan(entries, txt, chk_short_term_var, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Check short-term", command=lambda: on_check_short_term(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns, text="Browse rows…", command=lambda: on_browse(entries, chk_short_term_var)).pack(side="left", padx=(0,8))
+    ttk.Label(btns, text="Query trace:").pack(side="left", padx=(8,4))
+    trace_mode = ttk.Combobox(btns, values=TRACE_MODES, state="readonly", width=10)
+    trace_mode.current(0)
+    trace_mode.pack(side="left")
+    trace_mode.bind("<<ComboboxSelected>>", lambda ev: on_trace_mode(trace_mode, txt))
+
+    btns2 = ttk.Frame(main)
+    btns2.grid(row=9, column=0, columnspan=4, sticky="w", pady=(0,6))
+    batch = []
+    ttk.Button(btns2, text="Add to batch", command=lambda: on_batch_add(entries, txt, batch)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Load batch…", command=lambda: on_batch_load(entries, txt, batch)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Apply batch", command=lambda: on_batch_apply(entries, txt, chk_short_term_var, batch, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Clear batch", command=lambda: on_batch_clear(txt, batch)).pack(side="left", padx=(0,8))
+    ttk.Separator(btns2, orient="vertical").pack(side="left", fill="y", padx=(0,8))
+    ttk.Button(btns2, text="Undo last", command=lambda: on_undo_last(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Undo #…", command=lambda: on_undo_n(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Separator(btns2, orient="vertical").pack(side="left", fill="y", padx=(0,8))
+    ttk.Button(btns2, text="Working copy", command=lambda: on_wc_open(entries, txt, batch, runner, wc_var)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Commit to disk", command=lambda: on_wc_commit(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Keep disk rows", command=lambda: on_wc_keep_disk(entries, txt, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Discard copy", command=lambda: on_wc_discard(entries, txt, runner, wc_var)).pack(side="left", padx=(0,8))
+    ttk.Separator(btns2, orient="vertical").pack(side="left", fill="y", padx=(0,8))
+    ttk.Button(btns2, text="Rebase sum", command=lambda: on_rebase(entries, txt, chk_short_term_var, runner)).pack(side="left", padx=(0,8))
+    ttk.Button(btns2, text="Repair spikes", command=lambda: on_repair_spikes(entries, txt, chk_short_term_var, runner)).pack(side="left", padx=(0,8))
+
+    ttk.Label(main, text="Log (row times in the selected time zone):").grid(row=10, column=0, sticky="w", pady=(10,0))
+    log_text = tk.Text(main, height=28, width=140, state="disabled")
+    log_text.grid(row=11, column=0, columnspan=4, sticky="nsew")
+    scroll = ttk.Scrollbar(main, orient="vertical", command=log_text.yview)
+    scroll.grid(row=11, column=4, sticky="ns")
+    log_text.configure(yscrollcommand=scroll.set)
+    txt = LogPane(root, log_text)
+
+    status = ttk.Frame(main)
+    status.grid(row=10, column=1, columnspan=3, sticky="e", pady=(10,0))
+    ttk.Button(status, text="Export log…", command=lambda: on_export_log(txt)).pack(side="left", padx=(0,8))
+    ttk.Button(status, text="Clear log", command=txt.clear).pack(side="left", padx=(0,16))
+    wc_var = tk.StringVar(value="")
+    ttk.Label(status, textvariable=wc_var, foreground="darkorange").pack(side="left", padx=(0,8))
+    status_var = tk.StringVar(value="Idle")
+    ttk.Label(status, textvariable=status_var, foreground="gray").pack(side="left", padx=(0,8))
+    progress = ttk.Progressbar(status, length=220, maximum=100)
+    progress.pack(side="left", padx=(0,8))
+    cancel_btn = ttk.Button(status, text="Cancel", state="disabled")
+    cancel_btn.pack(side="left")
+    runner = TaskRunner(root, progress, status_var, cancel_btn, txt)
+    cancel_btn.configure(command=runner.cancel)
 
     main.columnconfigure(0, weight=1)
-    main.rowconfigure(10, weight=1)
+    main.rowconfigure(11, weight=1)
 
-    footer = ttk.Label(main, text="Close Home Assistant before applying. Undo by restoring the .bak created next to your DB.", foreground="gray")
-    footer.grid(row=11, column=0, columnspan=4, sticky="w", pady=(8,0))
+    footer = ttk.Label(main, text="Close Home Assistant before applying. Undo via the journal (Undo last / Undo #…) or restore a full .bak backup.", foreground="gray")
+    footer.grid(row=12, column=0, columnspan=4, sticky="w", pady=(8,0))
 
+    root.protocol("WM_DELETE_WINDOW", lambda: on_close(root))
     return root
 
+# --- command line: the same operations without Tk, JSON on stdout ---
+
+def journal_records(entries):
+    return [{"id": cid, "created": created, "rows": n_rows, "undone": undone, "description": description}
+            for cid, created, description, undone, n_rows in entries]
+
+# command -> fn(db_path, options, log_lines); options are the parsed arguments as a dict
+CLI_COMMANDS = {
+    "preview": lambda db, o, out: preview_changes(
+        db, o["entity_id"], o["start"], o["end"], o["tz"], out, o["columns"], o["short_term"]),
+    "diagnose": lambda db, o, out: diagnose(db, o["entity_id"], o["start"], o["end"], o["tz"], out, o["columns"]),
+    "dry-run": lambda db, o, out: dry_run_diff(
+        db, o["entity_id"], o["start"], o["end"], o["tz"], o["offset"], out, o["columns"]),
+    "apply": lambda db, o, out: apply_correction(
+        db, o["entity_id"], o["start"], o["end"], o["tz"], o["offset"], out, o["columns"], o["short_term"],
+        None if o["backup"] == "off" else o["backup"], chunked=o["chunked"]),
+    "resume": lambda db, o, out: resume_chunked_apply(db, out),
+    "batch": lambda db, o, out: apply_batch_corrections(
+        db, load_corrections(o["file"], o["columns"]), o["tz"], out, o["short_term"],
+        None if o["backup"] == "off" else o["backup"]),
+    "scan": lambda db, o, out: scan_jumps(
+        db, out, o["columns"], o["short_term"], o["top"], use_cache=not o["no_cache"], tz_str=o["tz"]),
+    "check": lambda db, o, out: check_short_term(db, out, o["entity_id"], tz_str=o["tz"]),
+    "rebase": lambda db, o, out: rebase_sum(
+        db, o["entity_id"], o["start"], o["end"], o["tz"], out, o["short_term"], o["mode"], o["fix_negative"]),
+    "repair-spikes": lambda db, o, out: repair_spikes(
+        db, o["entity_id"], o["start"], o["end"], o["tz"], out, o["short_term"]),
+    "undo": lambda db, o, out: undo_correction(db, out, o["id"]),
+    "journal": lambda db, o, out: journal_records(list_journal(db, out, o["limit"])),
+}
+
+def run_job(command, db_path, options):
+    # one command against one DB file; module level so worker processes can run it
+    global CONFIRM
+    CONFIRM = bool(options.get("yes"))  # e.g. "proceed without backup?"
+    if options.get("trace") is not None:
+        set_query_trace(True, options["trace"] or None)
+    lines = []
+    started = time.monotonic()
+    try:
+        result = CLI_COMMANDS[command](db_path, options, lines)
+    except Exception as e:
+        result = None
+        lines.append(f"ERROR: {e}")
+    if QUERY_TRACE is not None:
+        QUERY_TRACE.report(lines)
+    ok = result is not None and not any(line.startswith("ERROR") for line in lines)
+    return {"db": db_path, "command": command, "ok": ok, "seconds": round(time.monotonic() - started, 3),
+            "result": result, "log": lines}
+
+def run_jobs(command, db_paths, options, jobs=CLI_JOBS):
+    # several DB files run in a process pool, results in the order of db_paths
+    if len(db_paths) < 2 or jobs < 2:
+        return [run_job(command, db_path, options) for db_path in db_paths]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(db_paths))) as pool:
+        return list(pool.map(run_job, [command] * len(db_paths), db_paths, [options] * len(db_paths)))
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Home Assistant statistics fixer without the GUI. Prints a JSON list with one result per DB file; "
+                    "without arguments the GUI starts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dbs = argparse.ArgumentParser(add_help=False)
+    dbs.add_argument("db", nargs="+", help="recorder DB file(s), e.g. home-assistant_v2.db")
+    dbs.add_argument("--jobs", type=int, default=CLI_JOBS, help="worker processes for several DB files")
+    dbs.add_argument("--yes", action="store_true", help="answer confirmations with yes (needed for rebase and repair-spikes to write, proceed without backup)")
+    dbs.add_argument("--trace", metavar="JSONL", nargs="?", const="", default=None,
+                     help="query trace in the log, optionally also as JSON lines file")
+    entity = argparse.ArgumentParser(add_help=False)
+    entity.add_argument("--entity", dest="entity_id", required=True, help="statistic_id, e.g. sensor.energy_total")
+    rng = argparse.ArgumentParser(add_help=False)
+    rng.add_argument("--start", default="", help="local START, YYYY-MM-DD HH:MM[:SS][±HH:MM]")
+    rng.add_argument("--end", default="", help="local END (exclusive), empty = open end")
+    tz = argparse.ArgumentParser(add_help=False)
+    tz.add_argument("--tz", default=DEFAULT_TZ, help=f"IANA time zone (default {DEFAULT_TZ})")
+    cols = argparse.ArgumentParser(add_help=False)
+    cols.add_argument("--columns", choices=["sum", "state", "both"], default="sum")
+    short = argparse.ArgumentParser(add_help=False)
+    short.add_argument("--short-term", action="store_true", help="include statistics_short_term")
+    offset = argparse.ArgumentParser(add_help=False)
+    offset.add_argument("--offset", type=float, required=True, help="value added in the range (negative removes a jump)")
+    backup = argparse.ArgumentParser(add_help=False)
+    backup.add_argument("--backup", choices=BACKUP_MODES, default="off", help="full DB backup before writing")
+
+    sub.add_parser("preview", parents=[dbs, entity, rng, tz, cols, short], help="rows affected by a correction")
+    sub.add_parser("diagnose", parents=[dbs, entity, rng, tz, cols], help="rows around START/END")
+    sub.add_parser("dry-run", parents=[dbs, entity, rng, tz, cols, offset], help="consumption per period before vs after")
+    p = sub.add_parser("apply", parents=[dbs, entity, rng, tz, cols, short, offset, backup], help="add an offset in [START, END)")
+    p.add_argument("--chunked", action="store_true", help="commit in resumable chunks")
+    sub.add_parser("resume", parents=[dbs], help="finish an interrupted chunked apply")
+    p = sub.add_parser("batch", parents=[dbs, tz, cols, short, backup], help="corrections from a CSV/JSON file in one transaction")
+    p.add_argument("--file", required=True, help="CSV or JSON with entity_id,start,end,offset[,columns]")
+    p = sub.add_parser("scan", parents=[dbs, tz, cols, short], help="rank suspicious jumps of every statistic")
+    p.add_argument("--top", type=int, default=SCAN_TOP_N, help="hits listed in the log")
+    p.add_argument("--no-cache", action="store_true", help="ignore the incremental scan cache")
+    p = sub.add_parser("check", parents=[dbs, tz], help="short-term vs hourly consistency")
+    p.add_argument("--entity", dest="entity_id", default=None, help="one statistic_id (default: all)")
+    p = sub.add_parser("rebase", parents=[dbs, entity, rng, tz, short], help="rebuild sum with bad steps clamped")
+    p.add_argument("--mode", choices=REBASE_MODES, default=REBASE_MODES[0])
+    p.add_argument("--fix-negative", action="store_true", help="also treat every falling step as bad")
+    sub.add_parser("repair-spikes", parents=[dbs, entity, rng, tz, short], help="interpolate isolated state/mean/min/max outliers")
+    p = sub.add_parser("undo", parents=[dbs], help="undo the latest (or a given) correction")
+    p.add_argument("--id", type=int, default=None, help="journal entry #")
+    p = sub.add_parser("journal", parents=[dbs], help="list the undo journal")
+    p.add_argument("--limit", type=int, default=20)
+    return parser
+
+def main(argv=None):
+    options = vars(build_parser().parse_args(argv))
+    command, db_paths, jobs = options.pop("command"), options.pop("db"), options.pop("jobs")
+    results = run_jobs(command, db_paths, options, jobs)
+    json.dump(results, sys.stdout, indent=2, ensure_ascii=False, default=str)
+    sys.stdout.write("\n")
+    return 0 if all(job["ok"] for job in results) else 1
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    if tk is None:
+        sys.exit("tkinter is not available: use the command line (--help).")
     root = build_gui()
     root.mainloop()